@@ -0,0 +1,266 @@
+"""
+Load and latency benchmark for every route in main.py, run fully in process
+against the local stand-ins (see benchmarks/standins.py).
+
+    python -m benchmarks.run --requests 500 --concurrency 32 --output bench.json
+    python -m benchmarks.run --routes products_page,products_search --compare bench.json
+
+Each route is driven by ``--concurrency`` workers until ``--requests`` requests
+have completed; the report has throughput and p50/p95/p99 latency per route and
+is written as sorted JSON so two runs can be diffed.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import itertools
+import subprocess
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import httpx
+
+from benchmarks import standins
+
+logger = logging.getLogger("benchmarks")
+
+@dataclass
+class Route:
+    name: str
+    method: str
+    path: str
+    params: Callable[[int], Optional[dict]] = lambda n: None
+    body: Callable[[int], Optional[object]] = lambda n: None
+    auth: bool = False
+    conditional: bool = False
+    expect: tuple = (200,)
+    headers: dict = field(default_factory=dict)
+    # Prefijo esperado del Content-Type; si no coincide la peticion cuenta como error
+    content_type: Optional[str] = None
+
+def _new_product(n, categories, prefix="P"):
+    return {
+        "asin": f"{prefix}{os.getpid()}{n:08d}",
+        "title": f"benchmark product {n}",
+        "imgUrl": f"https://images.bench.local/new/{n}.jpg",
+        "productURL": f"https://www.bench.local/dp/new/{n}",
+        "stars": 4.5,
+        "price": 19.99,
+        "category_id": n % categories + 1,
+    }
+
+def build_routes(categories: int) -> list[Route]:
+    category = lambda n: {"category_id": n % categories + 1}
+    return [
+        Route("health", "GET", "/health"),
+        Route("health_database", "GET", "/health/database"),
+        Route("metrics", "GET", "/metrics", content_type="text/plain; version=0.0.4"),
+        Route("health_cache", "GET", "/health/cache"),
+        Route("ready", "GET", "/ready"),
+        Route("root", "GET", "/"),
+        Route("products_page", "GET", "/products", params=lambda n: {"limit": 100}),
+        Route("products_page_1000", "GET", "/products", params=lambda n: {"limit": 1000}),
+        Route("products_page_not_modified", "GET", "/products", params=lambda n: {"limit": 100},
+              conditional=True, expect=(304,)),
+        # Por encima de PRODUCTS_EXPORT_MAX_CONCURRENCY la API descarta con 503; se reporta en statuses
+        Route("products_export", "GET", "/products/export", params=lambda n: {"format": "ndjson"}, expect=(200, 503)),
+        Route("products_search", "GET", "/products/search",
+              params=lambda n: {"q": standins.WORDS[n % len(standins.WORDS)][:3], "limit": 20}),
+        Route("products_query", "GET", "/products/query",
+              params=lambda n: {"min_price": 10, "max_price": 100, "min_stars": 3.5, "sort": "price", "limit": 50}),
+        Route("products_by_category", "GET", "/products/", params=category),
+        Route("category_name", "GET", "/category/name/", params=category),
+        Route("category_count", "GET", "/category/count"),
+        Route("login", "POST", "/login",
+              body=lambda n: {"email": "user@bench.local", "password": standins.BENCH_PASSWORD}),
+        Route("signup", "POST", "/signup",
+              body=lambda n: {"email": f"user{os.getpid()}x{n}@bench.local", "password": standins.BENCH_PASSWORD,
+                              "firstName": "Bench", "lastName": "Signup"}),
+        Route("products_create", "POST", "/products", body=lambda n: _new_product(n, categories), auth=True,
+              expect=(201,)),
+        Route("products_bulk", "POST", "/products/bulk",
+              body=lambda n: [_new_product(n * 100 + i, categories, prefix="K") for i in range(100)], auth=True),
+    ]
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    position = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+def summarize(latencies: list[float], statuses: dict, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "status": {str(code): count for code, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50": round(percentile(values, 0.50) * 1000, 3),
+            "p95": round(percentile(values, 0.95) * 1000, 3),
+            "p99": round(percentile(values, 0.99) * 1000, 3),
+            "max": round(values[-1] * 1000, 3) if values else 0.0,
+        },
+    }
+
+async def run_route(client: httpx.AsyncClient, route: Route, requests: int, concurrency: int,
+                    token: str, counter: itertools.count) -> dict:
+    headers = dict(route.headers)
+    if route.auth:
+        headers["Authorization"] = f"Bearer {token}"
+    if route.conditional:
+        first = await client.request(route.method, route.path, params=route.params(0))
+        if first.headers.get("etag"):
+            headers["If-None-Match"] = first.headers["etag"]
+
+    latencies, statuses = [], {}
+    errors = 0
+    remaining = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while next(remaining) < requests:
+            n = next(counter)
+            body = route.body(n)
+            started = time.perf_counter()
+            try:
+                response = await client.request(route.method, route.path, params=route.params(n),
+                                                json=body, headers=headers)
+                await response.aread()
+                status = response.status_code
+                if route.content_type and not response.headers.get("content-type", "").startswith(route.content_type):
+                    status = "content_type"
+            except Exception as e:
+                logger.debug(f"{route.name}: {e}")
+                status = "exception"
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status not in route.expect:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, errors, time.perf_counter() - started)
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 120) -> None:
+    """The search index and the catalog snapshot are built in the background at startup"""
+    deadline = time.monotonic() + timeout
+    while (response := await client.get("/ready")).status_code == 503:
+        if time.monotonic() > deadline:
+            raise SystemExit(f"API not ready after {timeout}s: {response.json()['checks']}")
+        await asyncio.sleep(0.1)
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args) -> dict:
+    db_path = args.database or os.path.join(tempfile.mkdtemp(prefix="amazonapi-bench-"), "amazon.db")
+    if not args.database or not os.path.exists(db_path):
+        started = time.perf_counter()
+        standins.seed_database(db_path, products=args.products, categories=args.categories)
+        logger.info(f"Seeded {args.products} products in {time.perf_counter() - started:.1f}s ({db_path})")
+
+    standins.install(db_path, redis=not args.no_redis)
+    import main
+    from utils.security import create_jwt_token
+
+    routes = build_routes(args.categories)
+    if args.routes:
+        wanted = set(args.routes.split(","))
+        unknown = wanted - {route.name for route in routes}
+        if unknown:
+            raise SystemExit(f"Unknown routes: {', '.join(sorted(unknown))}")
+        routes = [route for route in routes if route.name in wanted]
+
+    results = {}
+    counter = itertools.count()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        headers = {"Accept-Encoding": args.accept_encoding}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=60) as client:
+            await wait_ready(client)
+            token = await create_jwt_token("Bench", "Admin", "admin@bench.local", True, True)
+            for route in routes:
+                if args.warmup:
+                    await run_route(client, route, args.warmup, min(args.concurrency, args.warmup), token, counter)
+                results[route.name] = await run_route(client, route, args.requests, args.concurrency, token, counter)
+                summary = results[route.name]
+                logger.info(f"{route.name:28s} {summary['throughput_rps']:9.1f} req/s  "
+                            f"p50 {summary['latency_ms']['p50']:8.2f} ms  p95 {summary['latency_ms']['p95']:8.2f} ms  "
+                            f"p99 {summary['latency_ms']['p99']:8.2f} ms  errors {summary['errors']}")
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "products": args.products,
+            "categories": args.categories,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "redis": not args.no_redis,
+            "accept_encoding": args.accept_encoding,
+        },
+        "routes": results,
+    }
+
+def compare(baseline: dict, current: dict) -> None:
+    print(f"{'route':28s} {'req/s':>18s} {'p50 ms':>20s} {'p99 ms':>20s}")
+    for name, summary in current["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if before is None:
+            continue
+        def delta(old, new):
+            change = (new - old) / old * 100 if old else 0.0
+            return f"{new:9.2f} ({change:+6.1f}%)"
+        print(f"{name:28s} {delta(before['throughput_rps'], summary['throughput_rps']):>18s} "
+              f"{delta(before['latency_ms']['p50'], summary['latency_ms']['p50']):>20s} "
+              f"{delta(before['latency_ms']['p99'], summary['latency_ms']['p99']):>20s}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every API route against local stand-ins")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients per route")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per route before measuring")
+    parser.add_argument("--products", type=int, default=40000, help="Products in the seeded dataset")
+    parser.add_argument("--categories", type=int, default=250, help="Categories in the seeded dataset")
+    parser.add_argument("--database", help="Reuse (or create) the SQLite dataset at this path")
+    parser.add_argument("--routes", help="Comma separated route names (default: all)")
+    parser.add_argument("--no-redis", action="store_true", help="Run without the in-process Redis")
+    parser.add_argument("--accept-encoding", default="gzip", help="Accept-Encoding sent by the clients")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Keep the API's own INFO logs")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not args.verbose:
+        # Los logs por peticion de la API distorsionan las mediciones
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as target:
+            target.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as source:
+            compare(json.load(source), report)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Local stand-ins for the services the API depends on, used by the benchmarks.
+
+- FakeKeyVault: in-memory secrets, installed with utils.keyvault.set_client_keyvault.
+- SQLite: the amazon.* tables in a SQLite file attached as ``amazon``, behind a
+  pyodbc-like connection that translates the few T-SQL constructs the API uses.
+- Redis: fakeredis (in-process) in place of redis.asyncio.from_url.
+- Firebase: an httpx MockTransport answering Identity Toolkit requests under
+  FIREBASE_AUTH_URL, plus a fake Admin SDK for create_user/delete_user.
+"""
+import os
+import re
+import json
+import types
+import random
+import sqlite3
+import itertools
+
+import httpx
+
+from utils import database, keyvault, http_client, redis_cache
+
+FIREBASE_AUTH_URL = "http://firebase.bench/v1"
+
+SECRETS = {
+    "jwt-secret-key": "benchmark-signing-key-0123456789abcdef",
+    "redis-connection-string": "redis://benchmark",
+    "firebase-api-key": "benchmark-api-key",
+    "firebase-secret": "{}",
+    "applicationinsights-connection-string": "",
+}
+
+WORDS = [
+    "echo", "dot", "kindle", "cable", "usb", "speaker", "phone", "case", "lamp", "desk",
+    "chair", "book", "wireless", "charger", "headphones", "mouse", "keyboard", "monitor",
+    "stand", "bottle", "backpack", "camera", "tripod", "light", "smart", "plug", "mini", "pro",
+]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS categories (
+        id INTEGER PRIMARY KEY,
+        category_name VARCHAR(255) NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS products (
+        asin VARCHAR(255) PRIMARY KEY,
+        title VARCHAR(500) NOT NULL,
+        imgUrl VARCHAR(500),
+        productURL VARCHAR(500),
+        stars FLOAT,
+        price FLOAT,
+        category_id INT NOT NULL REFERENCES categories(id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email VARCHAR(255) UNIQUE,
+        firstName VARCHAR(50),
+        lastName VARCHAR(50),
+        active BIT,
+        admin BIT
+    )""",
+]
+
+BENCH_PASSWORD = "Benchmark1!"
+BENCH_USERS = [
+    ("admin@bench.local", "Bench", "Admin", 1, 1),
+    ("user@bench.local", "Bench", "User", 1, 0),
+]
+
+class FakeKeyVault:
+    def __init__(self, secrets=None):
+        self.secrets = {**SECRETS, **(secrets or {})}
+
+    def get_secret(self, name):
+        return types.SimpleNamespace(value=self.secrets.get(name, name))
+
+def seed_database(path, products=40000, categories=250, seed=7):
+    """Creates the amazon tables in a SQLite file with a deterministic dataset"""
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO categories (id, category_name) VALUES (?, ?)",
+                     [(number, f"Benchmark Category {number} & More") for number in range(1, categories + 1)])
+
+    rng = random.Random(seed)
+    rows = (
+        (
+            f"B{number:09d}",
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))),
+            f"https://images.bench.local/{number}.jpg",
+            f"https://www.bench.local/dp/B{number:09d}",
+            round(rng.uniform(0, 5), 1) if rng.random() > 0.02 else None,
+            round(rng.uniform(1, 500), 2) if rng.random() > 0.02 else None,
+            rng.randint(1, categories),
+        )
+        for number in range(products)
+    )
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO users (email, firstName, lastName, active, admin) VALUES (?, ?, ?, ?, ?)", BENCH_USERS)
+    conn.commit()
+    conn.close()
+
+_TOP_PARAM = re.compile(r"^\s*select\s+top\s*\(\?\)\s*(.*?)\s*;?\s*$", re.I | re.S)
+_TOP_LITERAL = re.compile(r"^\s*select\s+top\s+(\d+)\s+(.*?)\s*;?\s*$", re.I | re.S)
+_USERS_INSERT = re.compile(r"^\s*exec\s+amazon\.users_insert\b", re.I)
+
+def translate(sql, params):
+    """Rewrites the T-SQL used by the API into SQLite"""
+    if params is None:
+        params = []
+    elif not isinstance(params, (list, tuple)):
+        params = [params]
+    params = list(params)
+
+    match = _TOP_PARAM.match(sql)
+    if match:
+        # TOP (?) es el primer parametro; LIMIT ? va al final
+        return f"SELECT {match.group(1)} LIMIT ?", params[1:] + params[:1]
+    match = _TOP_LITERAL.match(sql)
+    if match:
+        return f"SELECT {match.group(2)} LIMIT {match.group(1)}", params
+    if _USERS_INSERT.match(sql):
+        return ("INSERT INTO amazon.users (email, firstName, lastName, active, admin) VALUES (?, ?, ?, ?, ?) "
+                "RETURNING id, email, firstName, lastName, active, admin"), params
+    return sql, params
+
+class SqliteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.fast_executemany = False
+
+    def execute(self, sql, params=None):
+        sql, params = translate(sql, params)
+        try:
+            self._cursor.execute(sql, params)
+        except sqlite3.Error as e:
+            raise database.pyodbc.Error(str(e)) from e
+        return self
+
+    def executemany(self, sql, rows):
+        sql, _ = translate(sql, None)
+        try:
+            self._cursor.executemany(sql, rows)
+        except sqlite3.Error as e:
+            raise database.pyodbc.Error(str(e)) from e
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+class SqliteConnection:
+    """pyodbc-like connection over an in-memory SQLite with the dataset attached as ``amazon``"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(":memory:", timeout=30, check_same_thread=False)
+        self._conn.execute("ATTACH DATABASE ? AS amazon", (path,))
+        self._conn.execute("PRAGMA amazon.journal_mode=WAL")
+        # Como en SQL Server: un category_id inexistente se rechaza
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    def cursor(self):
+        return SqliteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+class FakeFirebaseAuth:
+    """Replaces firebase_admin.auth for signup; ``passwords`` is shared with the login transport"""
+
+    def __init__(self, passwords):
+        self.passwords = passwords
+        self.uids = {}
+        self._ids = itertools.count(1)
+
+    def create_user(self, email, password):
+        if email in self.passwords:
+            raise ValueError(f"The user with the provided email already exists ({email})")
+        record = types.SimpleNamespace(uid=f"bench-{next(self._ids)}", email=email)
+        self.passwords[email] = password
+        self.uids[record.uid] = email
+        return record
+
+    def delete_user(self, uid):
+        self.passwords.pop(self.uids.pop(uid, None), None)
+
+def firebase_transport(passwords):
+    """Identity Toolkit accounts:signInWithPassword answered in process"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("accounts:signInWithPassword"):
+            return httpx.Response(404, json={"error": {"message": "NOT_FOUND"}})
+        payload = json.loads(request.content)
+        if passwords.get(payload.get("email")) != payload.get("password"):
+            return httpx.Response(400, json={"error": {"message": "INVALID_LOGIN_CREDENTIALS"}})
+        return httpx.Response(200, json={"idToken": "firebase-token", "email": payload["email"]})
+
+    return httpx.MockTransport(handler)
+
+def install(db_path, redis=True):
+    """
+    Points the API at the stand-ins. Must run before ``main`` is imported so
+    controllers.firebase picks up FIREBASE_AUTH_URL.
+    """
+    os.environ["FIREBASE_AUTH_URL"] = FIREBASE_AUTH_URL
+    keyvault.set_client_keyvault(FakeKeyVault())
+
+    async def connect(read_only=False):
+        # La "replica" es el mismo fichero SQLite
+        return await database.run_blocking(SqliteConnection, db_path)
+    database.get_db_connection = connect
+
+    if redis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+
+        def from_url(url, decode_responses=False, **kwargs):
+            return fakeredis.FakeAsyncRedis(server=server, decode_responses=decode_responses)
+        redis_cache.redis.from_url = from_url
+    else:
+        # Sin connection string la API arranca sin Redis, como cuando Redis no responde
+        keyvault.set_client_keyvault(FakeKeyVault({"redis-connection-string": ""}))
+
+    # Firebase: Admin SDK falso y Identity Toolkit por MockTransport
+    import firebase_admin
+    from firebase_admin import credentials
+    from controllers import firebase
+
+    class BenchmarkCredential(credentials.Base):
+        def get_credential(self):
+            return None
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(BenchmarkCredential(), options={"projectId": "benchmark"})
+    # Los usuarios registrados por /signup tambien pueden hacer login
+    passwords = {email: BENCH_PASSWORD for email, *_ in BENCH_USERS}
+    firebase.firebase_auth = FakeFirebaseAuth(passwords)
+    http_client._client = httpx.AsyncClient(transport=firebase_transport(passwords))
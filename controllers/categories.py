@@ -1,40 +1,163 @@
+import os
 import json
+import asyncio
 import logging
 
 from fastapi import HTTPException
 
-from utils.database import execute_query_json
+from utils.database import execute_query_rows, execute_query_json
+from utils.redis_cache import get_redis_client, get_counters, replace_counters, increment_counters
 from utils.format_name_category import format_name_category
+from utils.metrics import span
 
 from models.productscategory import ProductsCategories
 
 logger = logging.getLogger(__name__)
 
+CATEGORY_INDEX_REFRESH = float(os.getenv("CATEGORY_INDEX_REFRESH", "600"))
+CATEGORY_COUNTS_RECONCILE = float(os.getenv("CATEGORY_COUNTS_RECONCILE", "300"))
+CATEGORY_COUNTS_KEY = "category:counts"
+# Consulta por id de categorias fuera del indice; tambien guarda los ids inexistentes
+CATEGORY_LOOKUP_CACHE_TTL = int(os.getenv("CATEGORY_LOOKUP_CACHE_TTL", "300"))
+
+# Indice en memoria de amazon.categories: id -> nombre formateado (y nombre tal cual en la BD)
+_category_names: dict[int, str] = {}
+_category_labels: dict[int, str] = {}
+_refresh_task: asyncio.Task | None = None
+
+# Conteo de productos por categoria; se usa cuando Redis no esta disponible
+_category_counts: dict[int, int] | None = None
+_reconcile_task: asyncio.Task | None = None
+
+async def load_category_index() -> int:
+    """Loads every category into the in-memory id -> formatted name index"""
+    result = await execute_query_rows("SELECT id, category_name FROM amazon.categories")
+    names = {}
+    labels = {}
+    for category_id, category_name in result.rows:
+        if category_name:
+            names[category_id] = await format_name_category(category_name)
+            labels[category_id] = category_name
+
+    # Se reemplaza el diccionario completo para que los lectores nunca vean un indice a medias
+    global _category_names, _category_labels
+    _category_names = names
+    _category_labels = labels
+    logger.info(f"Category index loaded ({len(names)} categories)")
+    return len(names)
+
+async def _refresh_category_index() -> None:
+    while True:
+        await asyncio.sleep(CATEGORY_INDEX_REFRESH)
+        try:
+            await load_category_index()
+        except Exception as e:
+            logger.warning(f"Failed to refresh category index: {e}")
+
+def start_category_index_refresh() -> None:
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_refresh_category_index())
+
+async def stop_category_index_refresh() -> None:
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+def get_category_ids() -> list[int]:
+    return list(_category_names)
+
 async def get_category_name_by_id(category_id: int) -> str:
     """Get category name by ID"""
+    name = _category_names.get(category_id)
+    if name is not None:
+        return name
+
+    #Categoria que aun no esta en el indice (nueva o indice sin cargar): se consulta y se agrega.
+    #El resultado, tambien el vacio, queda en la cache de consultas hasta que cambie amazon.categories
     query = "SELECT category_name FROM amazon.categories WHERE id = ?"
-    result = await execute_query_json(query, [category_id])
-    data = json.loads(result)
-    if not data:
+    result_json = await execute_query_json(query, [category_id], cache_ttl=CATEGORY_LOOKUP_CACHE_TTL)
+    with span("json.loads"):
+        rows = json.loads(result_json)
+    if not rows:
         raise HTTPException(status_code=404, detail="Category not found")
-    
+
     #Formatear el nombre de la categoria antes de retornarlo
-    name = await format_name_category(data[0]['category_name'])
+    label = rows[0]['category_name']
+    name = await format_name_category(label)
+    _category_names[category_id] = name
+    _category_labels[category_id] = label
 
     return name
 
+async def reconcile_category_counts() -> dict[int, int]:
+    """Recounts products per category in SQL and replaces the materialized counts"""
+    query = "SELECT category_id, COUNT(*) AS total_products FROM amazon.products GROUP BY category_id"
+    #Primario: reemplaza los contadores compartidos y no puede perder altas aun no replicadas
+    result = await execute_query_rows(query, primary=True)
+    counts = {category_id: total for category_id, total in result.rows}
+
+    global _category_counts
+    _category_counts = counts
+    await replace_counters(await get_redis_client(), CATEGORY_COUNTS_KEY, counts)
+    logger.info(f"Category counts reconciled ({len(counts)} categories)")
+    return counts
+
+async def _reconcile_category_counts() -> None:
+    while True:
+        try:
+            await reconcile_category_counts()
+        except Exception as e:
+            logger.warning(f"Failed to reconcile category counts: {e}")
+        await asyncio.sleep(CATEGORY_COUNTS_RECONCILE)
+
+def start_category_counts_reconcile() -> None:
+    global _reconcile_task
+    if _reconcile_task is None or _reconcile_task.done():
+        _reconcile_task = asyncio.create_task(_reconcile_category_counts())
+
+async def stop_category_counts_reconcile() -> None:
+    global _reconcile_task
+    if _reconcile_task is not None:
+        _reconcile_task.cancel()
+        try:
+            await _reconcile_task
+        except asyncio.CancelledError:
+            pass
+        _reconcile_task = None
+
+async def increment_category_counts(increments: dict[int, int]) -> None:
+    """Adds newly inserted products to the materialized counts"""
+    if _category_counts is not None:
+        for category_id, amount in increments.items():
+            _category_counts[category_id] = _category_counts.get(category_id, 0) + amount
+    await increment_counters(await get_redis_client(), CATEGORY_COUNTS_KEY, increments)
+
 async def get_count_products_by_category() -> list[dict]:
     """Get all categories with their product count"""
-    query = """    
-        SELECT c.id AS category_id, c.category_name AS category_name, COUNT(p.asin) AS total_products
-        FROM amazon.products p
-        JOIN amazon.categories c ON p.category_id = c.id
-        GROUP BY c.id, c.category_name
-        ORDER BY total_products DESC;
-    """
-    result = await execute_query_json(query)
-    data = json.loads(result)
+    counts = await get_counters(await get_redis_client(), CATEGORY_COUNTS_KEY)
+    if counts is not None:
+        counts = {int(category_id): total for category_id, total in counts.items()}
+    elif _category_counts is not None:
+        counts = _category_counts
+    else:
+        counts = await reconcile_category_counts()
+
+    if not _category_labels:
+        await load_category_index()
+
+    data = [
+        {"category_id": category_id, "category_name": _category_labels[category_id], "total_products": total}
+        for category_id, total in counts.items()
+        if total > 0 and category_id in _category_labels
+    ]
     if not data:
         raise HTTPException(status_code=404, detail="No categories found")
-    
-    return data
\ No newline at end of file
+
+    data.sort(key=lambda item: item["total_products"], reverse=True)
+    return data
@@ -1,8 +1,9 @@
 import os
 import json
+import asyncio
 import logging
 import firebase_admin
-import requests
+import httpx
 
 from fastapi import HTTPException
 from firebase_admin import credentials, auth as firebase_auth
@@ -11,6 +12,8 @@ from dotenv import load_dotenv
 from utils.database import execute_query_json
 from utils.security import create_jwt_token
 from utils.keyvault import get_secret_by_name
+from utils.http_client import get_http_client
+from utils.metrics import span
 
 from models.userregister import UserRegister
 from models.userlogin import UserLogin
@@ -19,6 +22,10 @@ from models.userlogin import UserLogin
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Segundos que se guarda en cache el usuario consultado en el login; el registro lo invalida
+USER_LOOKUP_CACHE_TTL = int(os.getenv("USER_LOOKUP_CACHE_TTL", "300"))
+USERS_TABLE = "amazon.users"
+
 # Inicializar la app de Firebase Admin usando secret de Key Vault
 async def initialize_firebase_admin():
     """Initialize Firebase Admin SDK using credentials from Azure Key Vault"""
@@ -48,17 +55,29 @@ async def initialize_firebase_admin():
             detail=f"Error al inicializar Firebase Admin: {e}"
         )
 
+async def warm_firebase() -> None:
+    """Initializes the Admin SDK and the shared HTTP client before the first signup/login"""
+    await initialize_firebase_admin()
+    get_http_client()
+
 load_dotenv()
 
+# Base de la API REST de Identity Toolkit; se puede apuntar al emulador o a un servidor local,
+# por ejemplo http://localhost:9099/identitytoolkit.googleapis.com/v1
+FIREBASE_AUTH_URL = os.getenv("FIREBASE_AUTH_URL", "https://identitytoolkit.googleapis.com/v1")
+
 async def register_user_firebase(user: UserRegister) -> dict:
     await initialize_firebase_admin()
 
     user_record = {}
     try:
-        user_record = firebase_auth.create_user(
-            email=user.email,
-            password=user.password
-        )
+        # El SDK de Firebase Admin es sincrono, se ejecuta fuera del event loop
+        with span("firebase.create_user"):
+            user_record = await asyncio.to_thread(
+                firebase_auth.create_user,
+                email=user.email,
+                password=user.password
+            )
 
     except Exception as e:
         logger.error(f"Error: {e}")
@@ -76,10 +95,11 @@ async def register_user_firebase(user: UserRegister) -> dict:
         user.admin
     )
     try:
-        result_json = await execute_query_json(query, params, needs_commit=True)
-        return json.loads(result_json)
+        result_json = await execute_query_json(query, params, needs_commit=True, tables=[USERS_TABLE])
+        with span("json.loads"):
+            return json.loads(result_json)
     except Exception as e:
-        firebase_auth.delete_user(user_record.uid)
+        await asyncio.to_thread(firebase_auth.delete_user, user_record.uid)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -88,14 +108,22 @@ async def login_user_firebase(user: UserLogin):
     
     # Autenticar usuario con Firebase Authentication usando la API REST
     api_key = await get_secret_by_name("firebase-api-key")
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={api_key}"
+    url = f"{FIREBASE_AUTH_URL}/accounts:signInWithPassword"
     payload = {
         "email": user.email,
         "password": user.password,
         "returnSecureToken": True
     }
-    response = requests.post(url, json=payload)
-    response_data = response.json()
+    try:
+        with span("firebase.sign_in"):
+            response = await get_http_client().post(url, params={"key": api_key}, json=payload)
+            response_data = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        logger.error(f"Error al conectar con Firebase Authentication: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Servicio de autenticación no disponible"
+        )
 
     if "error" in response_data:
         raise HTTPException(
@@ -114,8 +142,12 @@ async def login_user_firebase(user: UserLogin):
                 """
 
     try:
-        result_json = await execute_query_json(query, (user.email,), needs_commit=False)
-        result_dict = json.loads(result_json)
+        # Primario: el usuario puede haberse registrado hace un instante en otro worker;
+        # el registro invalida la cache de amazon.users, asi que la cache no lo oculta
+        result_json = await execute_query_json(query, (user.email,), needs_commit=False, primary=True,
+                                               cache_ttl=USER_LOOKUP_CACHE_TTL)
+        with span("json.loads"):
+            result_dict = json.loads(result_json)
         jwt_token = await create_jwt_token(
             result_dict[0]["firstName"],
             result_dict[0]["lastName"],
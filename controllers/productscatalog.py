@@ -1,13 +1,24 @@
+import os
 import json
+import asyncio
+import base64
+import binascii
 import logging
-#from typing import Optional
+from collections import Counter
+from typing import Optional, AsyncIterator
 
 from fastapi import HTTPException
+from pydantic import TypeAdapter, ValidationError
 
-from utils.database import execute_query_json
-from utils.redis_cache import get_redis_client, store_in_cache, get_from_cache, delete_cache
+from utils.database import execute_query_rows, execute_many, stream_query, SQL_POOL_MAX_SIZE
+from utils.redis_cache import get_redis_client, get_or_build_entry, get_encoded, CacheEntry
+from utils.query_cache import table_tag
+from utils.responses import dumps, project
+from utils.search_index import get_search_index, index_products
+from utils.catalog_snapshot import get_catalog_snapshot, add_to_catalog_snapshot
+from utils.metrics import span
 
-from controllers.categories import get_category_name_by_id
+from controllers.categories import get_category_name_by_id, get_category_ids, get_count_products_by_category, increment_category_counts
 
 from models.productscatalog import ProductsCatalog
 
@@ -15,38 +26,167 @@ logger = logging.getLogger(__name__)
 
 PRODUCTS_CACHE_KEY = "products:catalog:all"
 CACHE_TTL = 1800
+#Las llaves del catalogo se marcan como vencidas con cada escritura en amazon.products
+PRODUCTS_TABLE_TAG = table_tag("amazon.products")
 
-async def get_products_catalog() -> list[ProductsCatalog]:
+PRODUCTS_BULK_MAX_ITEMS = int(os.getenv("PRODUCTS_BULK_MAX_ITEMS", "10000"))
+
+#Cada exportacion retiene una conexion del pool hasta que el cliente termina de leer
+PRODUCTS_EXPORT_MAX_CONCURRENCY = int(os.getenv("PRODUCTS_EXPORT_MAX_CONCURRENCY", str(max(1, SQL_POOL_MAX_SIZE // 4))))
+_exports_running = 0
+
+INSERT_PRODUCT_QUERY = """
+    insert into amazon.products(
+        asin,
+        title,
+        imgUrl,
+        productURL,
+        stars,
+        price,
+        category_id
+    ) values(
+        ?, ?, ?, ?, ?, ?, ?
+    )
+"""
+
+_products_adapter = TypeAdapter(list[ProductsCatalog])
+
+# Campos que expone ProductsCatalog, en su orden; las filas propias (BD, cache, indices)
+# se proyectan a estos campos y se codifican sin volver a validarlas
+PRODUCT_FIELDS = tuple(ProductsCatalog.model_fields)
+
+PRODUCTS_PAGE_DEFAULT_LIMIT = int(os.getenv("PRODUCTS_PAGE_DEFAULT_LIMIT", "100"))
+PRODUCTS_PAGE_MAX_LIMIT = int(os.getenv("PRODUCTS_PAGE_MAX_LIMIT", "1000"))
+
+PRODUCTS_SEARCH_DEFAULT_LIMIT = int(os.getenv("PRODUCTS_SEARCH_DEFAULT_LIMIT", "20"))
+PRODUCTS_SEARCH_MAX_LIMIT = int(os.getenv("PRODUCTS_SEARCH_MAX_LIMIT", "100"))
+
+def encode_cursor(asin: str) -> str:
+    """Opaque token pointing after the given asin"""
+    return base64.urlsafe_b64encode(asin.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        asin = base64.b64decode(cursor + padding, altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not asin:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return asin
+
+async def get_products_catalog(limit: int = PRODUCTS_PAGE_DEFAULT_LIMIT, after: Optional[str] = None) -> tuple[bytes, Optional[str], CacheEntry]:
+    """Returns one page of the catalog ordered by asin as JSON bytes, the cursor of the next page and its cache entry"""
+    after_asin = decode_cursor(after) if after else None
+
+    async def load_page() -> dict:
+        #Se pide una fila extra para saber si existe una pagina siguiente
+        if after_asin is None:
+            query = "SELECT TOP (?) * FROM amazon.products ORDER BY asin"
+            params = [limit + 1]
+        else:
+            query = "SELECT TOP (?) * FROM amazon.products WHERE asin > ? ORDER BY asin"
+            params = [limit + 1, after_asin]
+
+        #Primario: la pagina queda en cache CACHE_TTL y no puede venir de una replica atrasada
+        result = await execute_query_rows(query, params, primary=True)
+        rows = result.as_dicts()
+        if not rows and after_asin is None:
+            raise HTTPException(status_code=404, detail="Products catalog not found")
+
+        next_cursor = encode_cursor(rows[limit - 1]["asin"]) if len(rows) > limit else None
+        return {"items": rows[:limit], "next_cursor": next_cursor}
+
+    #Cada pagina tiene su propia key, registrada en el grupo de amazon.products para invalidarlas juntas.
+    #La key sale del asin decodificado: variantes del mismo cursor (con o sin padding) comparten pagina
+    cache_key = f"{PRODUCTS_CACHE_KEY}:{limit}:{encode_cursor(after_asin) if after_asin is not None else 'start'}"
     redis_client = await get_redis_client()
-    cached_data = get_from_cache( redis_client , PRODUCTS_CACHE_KEY )
-    if cached_data:
-        return [ProductsCatalog(**item) for item in cached_data]
+    entry = await get_or_build_entry( redis_client , cache_key , load_page , CACHE_TTL , groups=[PRODUCTS_TABLE_TAG] )
+    body = get_encoded(cache_key, entry, lambda page: dumps(project(page["items"], PRODUCT_FIELDS)))
+    return body, entry.data["next_cursor"], entry
 
-    query = "select top 40000 * from amazon.products"
-    result = await execute_query_json(query)
-    dict = json.loads(result)
-    if not dict:
-        raise HTTPException(status_code=404, detail="Products catalog not found")
+async def _export_batches() -> AsyncIterator[list[dict]]:
+    global _exports_running
+    if _exports_running >= PRODUCTS_EXPORT_MAX_CONCURRENCY:
+        raise HTTPException(status_code=503, detail="Too many exports in progress", headers={"Retry-After": "5"})
+    _exports_running += 1
+    try:
+        async for batch in stream_query("SELECT * FROM amazon.products ORDER BY asin"):
+            yield batch
+    finally:
+        _exports_running -= 1
 
-    store_in_cache( redis_client , PRODUCTS_CACHE_KEY , dict , CACHE_TTL )
-    return [ProductsCatalog(**item) for item in dict]
+async def export_products_catalog(format: str = "ndjson") -> AsyncIterator[bytes]:
+    """
+    Streams the whole catalog ordered by asin as NDJSON or as a JSON array.
 
-async def create_product( product_data: ProductsCatalog ) -> ProductsCatalog:
-    insert_query = """
-        insert into amazon.products(
-            asin,
-            title,
-            imgUrl,
-            productURL,
-            stars,
-            price,
-            category_id
-        ) values(
-            ?, ?, ?, ?, ?, ?, ?
-        )
+    The first batch is read before returning so database errors still produce a
+    regular error response instead of a truncated body. At most
+    PRODUCTS_EXPORT_MAX_CONCURRENCY exports run at once; the rest get a 503.
     """
+    batches = _export_batches()
+    first_batch = await anext(batches, None)
+
+    async def ndjson():
+        batch = first_batch
+        while batch is not None:
+            yield b"".join(dumps(row) + b"\n" for row in project(batch, PRODUCT_FIELDS))
+            batch = await anext(batches, None)
+
+    async def json_array():
+        yield b"["
+        batch = first_batch
+        separator = b""
+        while batch is not None:
+            yield separator + dumps(project(batch, PRODUCT_FIELDS))[1:-1]
+            separator = b","
+            batch = await anext(batches, None)
+        yield b"]"
+
+    return ndjson() if format == "ndjson" else json_array()
 
-    params = [
+async def search_products(q: str, limit: int = PRODUCTS_SEARCH_DEFAULT_LIMIT, offset: int = 0) -> tuple[bytes, int]:
+    """Searches product titles in the in-memory index; returns one page as JSON bytes and the total of matches"""
+    index = get_search_index()
+    if index is None:
+        raise HTTPException(status_code=503, detail="Search index is not ready", headers={"Retry-After": "5"})
+
+    with span("search.query"):
+        total, rows = index.search(q, limit, offset)
+    with span("response.encode"):
+        return dumps(rows), total
+
+async def query_products(
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_stars: Optional[float] = None,
+    category_ids: Optional[list[int]] = None,
+    sort: str = "asin",
+    order: str = "asc",
+    limit: int = PRODUCTS_PAGE_DEFAULT_LIMIT,
+    offset: int = 0
+) -> tuple[bytes, int]:
+    """Filters and sorts the in-memory catalog snapshot; returns one page as JSON bytes and the total of matches"""
+    snapshot = get_catalog_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Catalog snapshot is not ready", headers={"Retry-After": "5"})
+
+    with span("snapshot.query"):
+        total, rows = snapshot.query(
+            min_price=min_price,
+            max_price=max_price,
+            min_stars=min_stars,
+            categories=category_ids,
+            sort=sort,
+            descending=order == "desc",
+            limit=limit,
+            offset=offset
+        )
+    with span("response.encode"):
+        return dumps(project(rows, PRODUCT_FIELDS)), total
+
+def _product_params(product_data: ProductsCatalog) -> list:
+    return [
         product_data.asin,
         product_data.title,
         product_data.imgUrl,
@@ -56,46 +196,171 @@ async def create_product( product_data: ProductsCatalog ) -> ProductsCatalog:
         product_data.category_id
     ]
 
-    insert_result = await execute_query_json( insert_query , params, needs_commit=True )
+async def create_product( product_data: ProductsCatalog ) -> ProductsCatalog:
+    params = _product_params(product_data)
+
+    #El insert invalida las llaves de amazon.products (paginas y categorias): se siguen
+    #sirviendo vencidas mientras una sola peticion las reconstruye
+    await execute_query_rows( INSERT_PRODUCT_QUERY , params, needs_commit=True )
+    created = [product_data.model_dump()]
+    index_products(created)
+    await add_to_catalog_snapshot(created)
+    await increment_category_counts({product_data.category_id: 1})
 
-    created_object = ProductsCatalog(
-        asin=product_data.asin,
-        title=product_data.title,
-        imgUrl=product_data.imgUrl,
-        productURL=product_data.productURL,
-        stars=product_data.stars,
-        price=product_data.price,
-        category_id=product_data.category_id
-    )
+    with span("pydantic.build"):
+        created_object = ProductsCatalog(
+            asin=product_data.asin,
+            title=product_data.title,
+            imgUrl=product_data.imgUrl,
+            productURL=product_data.productURL,
+            stars=product_data.stars,
+            price=product_data.price,
+            category_id=product_data.category_id
+        )
 
-    redis_client = await get_redis_client()
-    cache_deleted = delete_cache( redis_client, PRODUCTS_CACHE_KEY )
+    return created_object
 
-    #Obtener el nombre de la categoria del nuevo producto para eliminar tambien su cache
-    category_name = await get_category_name_by_id(product_data.category_id)
-    cache_key = f"products:catalog:{category_name}"
+def parse_bulk_body(body: bytes, content_type: str) -> tuple[list, list[dict]]:
+    """
+    Parses a bulk request body, either a JSON array or NDJSON (one product per line).
+    Returns the raw items and the per-row errors of lines that are not valid JSON.
+    """
+    errors = []
+    if "ndjson" in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                with span("json.loads"):
+                    items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                errors.append({"index": len(items), "asin": None, "error": f"Invalid JSON: {e.msg}"})
+                items.append(None)
+    else:
+        try:
+            with span("json.loads"):
+                items = json.loads(body)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON body: {e.msg}")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of products")
 
-    cache_deleted = delete_cache( redis_client, cache_key )
+    if len(items) > PRODUCTS_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {PRODUCTS_BULK_MAX_ITEMS} products per request")
+    return items, errors
 
-    return created_object
+async def create_products_bulk( items: list, errors: Optional[list[dict]] = None ) -> dict:
+    """
+    Validates and inserts many products at once. Rows are written with
+    fast_executemany in chunked transactions and the cache of amazon.products is
+    invalidated once for the whole batch. Invalid rows are reported, not raised.
+    """
+    errors = list(errors or [])
+    failed = {error["index"] for error in errors}
+
+    #Validacion en lote; si falla se identifican las filas con error y se validan solo las demas
+    candidates = [(index, item) for index, item in enumerate(items) if index not in failed]
+    try:
+        with span("pydantic.validate"):
+            products = _products_adapter.validate_python([item for _, item in candidates])
+    except ValidationError as e:
+        invalid = {}
+        for error in e.errors():
+            position = error["loc"][0]
+            field = ".".join(str(part) for part in error["loc"][1:])
+            invalid.setdefault(position, []).append(f"{field}: {error['msg']}" if field else error["msg"])
+        for position, messages in invalid.items():
+            index, item = candidates[position]
+            errors.append({"index": index, "asin": item.get("asin") if isinstance(item, dict) else None, "error": "; ".join(messages)})
+        candidates = [candidate for position, candidate in enumerate(candidates) if position not in invalid]
+        with span("pydantic.validate"):
+            products = _products_adapter.validate_python([item for _, item in candidates])
+
+    #Los productos de categorias inexistentes no se envian a la BD
+    category_names = {}
+    for category_id in {product.category_id for product in products}:
+        try:
+            category_names[category_id] = await get_category_name_by_id(category_id)
+        except HTTPException:
+            pass
 
-async def get_products_by_category(category_id) -> list[ProductsCatalog]:
+    rows = []
+    row_indexes = []
+    products_by_index = {}
+    for (index, _), product in zip(candidates, products):
+        if product.category_id not in category_names:
+            errors.append({"index": index, "asin": product.asin, "error": "Category not found"})
+            continue
+        rows.append(_product_params(product))
+        row_indexes.append(index)
+        products_by_index[index] = product
+
+    insert_errors = await execute_many( INSERT_PRODUCT_QUERY , rows ) if rows else []
+    for position, error in insert_errors:
+        errors.append({"index": row_indexes[position], "asin": rows[position][0], "error": error})
+
+    rejected = {position for position, _ in insert_errors}
+    inserted = [products_by_index[row_indexes[position]] for position in range(len(rows)) if position not in rejected]
+    created = [product.model_dump() for product in inserted]
+    index_products(created)
+    await add_to_catalog_snapshot(created)
+
+    inserted_categories = Counter(product.category_id for product in inserted)
+    if inserted_categories:
+        await increment_category_counts(inserted_categories)
+
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "received": len(items),
+        "inserted": len(rows) - len(rejected),
+        "failed": len(errors),
+        "errors": errors
+    }
+
+async def get_products_by_category(category_id) -> tuple[bytes, CacheEntry]:
     #Obtener el nombre de la categoria
     category_name = await get_category_name_by_id(category_id)
 
     #Generar la key de forma dinamica usando el nombre de la categoria consultada previamente formateada
     cache_key = f"products:catalog:{category_name}"
     
+    async def load_category() -> list[dict]:
+        query = "SELECT * FROM amazon.products WHERE category_id = ?"
+        result = await execute_query_rows(query, category_id, primary=True)
+        rows = result.as_dicts()
+        if not rows:
+            raise HTTPException(status_code=404, detail="Products catalog not found")
+        return rows
+
     redis_client = await get_redis_client()
-    cached_data_category = get_from_cache( redis_client , cache_key )
-    if cached_data_category:
-        return [ProductsCatalog(**item) for item in cached_data_category]
-
-    query = "SELECT * FROM amazon.products WHERE category_id = ?"
-    result = await execute_query_json(query, category_id)
-    dict = json.loads(result)
-    if not dict:
-        raise HTTPException(status_code=404, detail="Products catalog not found")
-
-    store_in_cache( redis_client , cache_key , dict , CACHE_TTL )
-    return [ProductsCatalog(**item) for item in dict]
+    entry = await get_or_build_entry( redis_client , cache_key , load_category , CACHE_TTL , groups=[PRODUCTS_TABLE_TAG] )
+    return get_encoded(cache_key, entry, lambda rows: dumps(project(rows, PRODUCT_FIELDS))), entry
+
+async def prewarm_catalog_cache(category_limit: int = 0, concurrency: int = 4) -> int:
+    """
+    Builds (or pulls from Redis into the local cache) the first catalog page and
+    the per-category keys, biggest categories first. Returns the keys warmed.
+    """
+    await get_products_catalog()
+
+    try:
+        category_ids = [row["category_id"] for row in await get_count_products_by_category()]
+    except HTTPException:
+        #Sin conteos se precargan las categorias del indice, en su orden
+        category_ids = get_category_ids()
+    if category_limit:
+        category_ids = category_ids[:category_limit]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def warm(category_id) -> bool:
+        async with semaphore:
+            try:
+                await get_products_by_category(category_id)
+                return True
+            except HTTPException:
+                return False
+
+    warmed = await asyncio.gather(*(warm(category_id) for category_id in category_ids))
+    return 1 + sum(warmed)
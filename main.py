@@ -1,20 +1,38 @@
 import uvicorn
 import logging
 
-from fastapi import FastAPI, Response, Request
+from typing import Annotated, Optional, Literal
+from fastapi import FastAPI, Response, Request, Query, Depends
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import Field
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
-from controllers.firebase import register_user_firebase, login_user_firebase
-from controllers.productscatalog import get_products_catalog, create_product, get_products_by_category
-from controllers.categories import get_category_name_by_id, get_count_products_by_category
+from controllers.firebase import register_user_firebase, login_user_firebase, warm_firebase
+from controllers.productscatalog import get_products_catalog, export_products_catalog, search_products, query_products, create_product, create_products_bulk, parse_bulk_body, get_products_by_category, prewarm_catalog_cache, PRODUCTS_PAGE_DEFAULT_LIMIT, PRODUCTS_PAGE_MAX_LIMIT, PRODUCTS_SEARCH_DEFAULT_LIMIT, PRODUCTS_SEARCH_MAX_LIMIT
+from controllers.categories import get_category_name_by_id, get_count_products_by_category, load_category_index, start_category_index_refresh, stop_category_index_refresh, start_category_counts_reconcile, stop_category_counts_reconcile
 
 from models.userregister import UserRegister
 from models.userlogin import UserLogin
 from models.productscatalog import ProductsCatalog
 
-from utils.security import validateadmin
+from utils.security import require_user
+from utils.http_cache import make_etag, cache_headers, is_not_modified
+from utils.responses import JSONBytesResponse
+from utils.compression import CompressionMiddleware
+from utils.metrics import MetricsMiddleware, register_gauges, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from utils.telemetry import setup_simple_telemetry, instrument_fastapi_app
+from utils.database import open_db_pools, close_db_pool, get_pool_stats
+from utils.http_client import close_http_client
+from utils.keyvault import prefetch_secrets
+from utils.search_index import start_search_index, stop_search_index, get_search_index
+from utils.catalog_snapshot import start_catalog_snapshot, stop_catalog_snapshot, get_catalog_snapshot
+from utils.startup import (
+    STARTUP_WARMUP, WARMUP_SECRETS, WARMUP_DATABASE, WARMUP_REDIS, WARMUP_FIREBASE, WARMUP_CATALOG,
+    WARMUP_CATEGORY_LIMIT, WARMUP_CONCURRENCY,
+    run_phase, mark_startup_begin, mark_startup_complete, reset_startup, register_readiness_check, get_readiness
+)
+from utils.redis_cache import init_redis_client, close_redis_client, start_cache_invalidation_listener, stop_cache_invalidation_listener, get_local_cache_stats, get_codec_stats
 
 logging.basicConfig( level=logging.INFO )
 logger = logging.getLogger(__name__)
@@ -24,17 +42,52 @@ load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    telemetry_enabled = await setup_simple_telemetry()
+    #Cada fase se mide por separado (ver /ready); una fase que falla no detiene el arranque
+    mark_startup_begin()
+
+    #Secrets en paralelo: las fases siguientes los leen de la cache
+    await run_phase("secrets", prefetch_secrets, enabled=STARTUP_WARMUP and WARMUP_SECRETS)
+
+    telemetry_enabled = await run_phase("telemetry", setup_simple_telemetry)
     if telemetry_enabled:
         instrument_fastapi_app(app)
         logger.info("Application Insights enabled")
         logger.info("FastAPI Instrumented")
     else:
         logger.warning("Application Insight disabled")
-    
+
+    #Sin calentamiento Redis y el pool SQL se conectan con la primera peticion que los usa
+    await run_phase("redis", init_redis_client, enabled=STARTUP_WARMUP and WARMUP_REDIS)
+    start_cache_invalidation_listener()
+    await run_phase("database", open_db_pools, enabled=STARTUP_WARMUP and WARMUP_DATABASE)
+    await run_phase("firebase", warm_firebase, enabled=STARTUP_WARMUP and WARMUP_FIREBASE)
+
+    # Sin indice las categorias se consultan en la BD hasta el siguiente refresco
+    await run_phase("category_index", load_category_index)
+    start_category_index_refresh()
+    start_category_counts_reconcile()
+
+    #El indice de busqueda y el snapshot columnar se construyen en segundo plano; responden 503 hasta tenerlos
+    start_search_index()
+    start_catalog_snapshot()
+
+    #Primera pagina del catalogo y llaves por categoria en Redis y en la cache local
+    await run_phase("catalog_cache", prewarm_catalog_cache, WARMUP_CATEGORY_LIMIT, WARMUP_CONCURRENCY,
+                    enabled=STARTUP_WARMUP and WARMUP_CATALOG)
+    mark_startup_complete()
+
     logger.info("Starting API...")
     yield
     logger.info("Shutting down API...")
+    reset_startup()
+    await stop_catalog_snapshot()
+    await stop_search_index()
+    await stop_category_counts_reconcile()
+    await stop_category_index_refresh()
+    await close_http_client()
+    await stop_cache_invalidation_listener()
+    await close_redis_client()
+    await close_db_pool()
 
 app = FastAPI(
     title="Amazon API",
@@ -43,6 +96,19 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+#Compresion br/gzip negociada por peticion (Accept-Encoding)
+app.add_middleware(CompressionMiddleware)
+#Latencia por ruta; se agrega al final para medir tambien la compresion
+app.add_middleware(MetricsMiddleware)
+
+register_readiness_check("search_index", lambda: get_search_index() is not None)
+register_readiness_check("catalog_snapshot", lambda: get_catalog_snapshot() is not None)
+
+register_gauges("db_pool", "SQL connection pool occupancy and wait times", lambda: get_pool_stats().get("primary", {}))
+register_gauges("db_replica_pool", "SQL read-replica pool occupancy and wait times",
+                lambda: get_pool_stats().get("replica", {}))
+register_gauges("local_cache", "Local (L1) cache size and hit counts", get_local_cache_stats)
+
 @app.get("/health")
 async def health_check():
     return {
@@ -50,6 +116,30 @@ async def health_check():
         "version": "0.1.0"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """200 once the startup warm-up finished and the background indexes are built, 503 before that"""
+    readiness = get_readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/health/database")
+async def database_pool_stats():
+    """Occupancy and wait times of the SQL connection pools (primary and read replica)"""
+    return get_pool_stats()
+
+@app.get("/health/cache")
+async def cache_stats():
+    """Local (L1) cache usage and per-key size/timing of the Redis cache codec"""
+    return {
+        "local": get_local_cache_stats(),
+        "codec": get_codec_stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition: per-stage timings, cache hit/miss counters, pool and L1 gauges"""
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 async def read_root(request: Request, response: Response):
     return {
@@ -69,22 +159,79 @@ async def login(user: UserLogin):
     return result
 
 
-@app.get("/products")
-async def get_products() -> list[ProductsCatalog]:
-    """Get all products from the catalog"""
-    products: list[ProductsCatalog] = await get_products_catalog()
-    return products
-
-@app.post("/products", response_model=ProductsCatalog, status_code=201)
-@validateadmin
+def cached_response(request: Request, body: bytes, entry, headers: Optional[dict] = None) -> Response:
+    """Pre-encoded body of a cache entry, or 304 when the client already has this version"""
+    headers = dict(headers or {})
+    if entry.version:
+        etag = make_etag(entry.version)
+        headers.update(cache_headers(etag, entry.built_at))
+        if is_not_modified(request, etag, entry.built_at):
+            return Response(status_code=304, headers=headers)
+    return JSONBytesResponse(body, headers=headers)
+
+#Las rutas del catalogo devuelven bytes ya codificados; response_model solo documenta el esquema
+@app.get("/products", response_model=list[ProductsCatalog])
+async def get_products(
+    request: Request,
+    limit: int = Query(default=PRODUCTS_PAGE_DEFAULT_LIMIT, ge=1, le=PRODUCTS_PAGE_MAX_LIMIT),
+    after: Optional[str] = Query(default=None, description="Cursor returned in X-Next-Cursor")
+):
+    """Get a page of products from the catalog ordered by asin"""
+    body, next_cursor, entry = await get_products_catalog(limit, after)
+    headers = {}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(after=next_cursor)}>; rel="next"'
+    return cached_response(request, body, entry, headers)
+
+@app.get("/products/export")
+async def export_products(format: Literal["ndjson", "json"] = "ndjson"):
+    """Stream the whole catalog as NDJSON (one product per line) or as a JSON array"""
+    content = await export_products_catalog(format)
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(content, media_type=media_type)
+
+@app.get("/products/search", response_model=list[ProductsCatalog])
+async def search_products_by_title(
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=PRODUCTS_SEARCH_DEFAULT_LIMIT, ge=1, le=PRODUCTS_SEARCH_MAX_LIMIT),
+    offset: int = Query(default=0, ge=0)
+):
+    """Search products by title (prefix match on every word), best rated first"""
+    body, total = await search_products(q, limit, offset)
+    return JSONBytesResponse(body, headers={"X-Total-Count": str(total)})
+
+@app.get("/products/query", response_model=list[ProductsCatalog])
+async def query_products_catalog(
+    min_price: Optional[float] = Query(default=None, ge=0),
+    max_price: Optional[float] = Query(default=None, ge=0),
+    min_stars: Optional[float] = Query(default=None, ge=0, le=5),
+    category_id: Optional[list[Annotated[int, Field(ge=1, le=2**31 - 1)]]] = Query(
+        default=None, description="Repeat to filter by several categories"),
+    sort: Literal["asin", "price", "stars"] = "asin",
+    order: Literal["asc", "desc"] = "asc",
+    limit: int = Query(default=PRODUCTS_PAGE_DEFAULT_LIMIT, ge=1, le=PRODUCTS_PAGE_MAX_LIMIT),
+    offset: int = Query(default=0, ge=0)
+):
+    """Filter the catalog by price range, minimum stars and categories, sorted and paginated"""
+    body, total = await query_products(min_price, max_price, min_stars, category_id, sort, order, limit, offset)
+    return JSONBytesResponse(body, headers={"X-Total-Count": str(total)})
+
+@app.post("/products", response_model=ProductsCatalog, status_code=201, dependencies=[Depends(require_user(admin=True))])
 async def create_new_product(request: Request, response: Response, product_data: ProductsCatalog) -> ProductsCatalog:
     cp = await create_product(product_data)
     return cp
 
-@app.get("/products/")
-async def get_products_by_category_id(category_id: int) -> list[ProductsCatalog]:
-    products_by_category_id: list[ProductsCatalog] = await get_products_by_category(category_id)
-    return products_by_category_id
+@app.post("/products/bulk", dependencies=[Depends(require_user(admin=True))])
+async def create_new_products_bulk(request: Request):
+    """Insert many products from a JSON array or an NDJSON body (application/x-ndjson)"""
+    items, errors = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    return await create_products_bulk(items, errors)
+
+@app.get("/products/", response_model=list[ProductsCatalog])
+async def get_products_by_category_id(request: Request, category_id: int):
+    body, entry = await get_products_by_category(category_id)
+    return cached_response(request, body, entry)
 
 #Otros endpoints
 @app.get("/category/name/")
@@ -94,7 +241,12 @@ async def get_category_name(request: Request, response: Response, category_id: i
 
 @app.get("/category/count")
 async def get_count(request: Request, response: Response):
-    return await get_count_products_by_category()
+    counts = await get_count_products_by_category()
+    etag = make_etag(*[f"{item['category_id']}:{item['total_products']}" for item in counts])
+    headers = cache_headers(etag)
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONBytesResponse(counts, headers=headers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,435 @@
+"""
+Offline loader for the Amazon products dataset (Kaggle CSV) into amazon.products.
+
+Streams the CSV in chunks, maps every row onto the ProductsCatalog fields,
+checks it against the table constraints, upserts the categories and inserts
+the products with fast_executemany using parallel workers. Rows that cannot be
+inserted are reported and skipped; a chunk that fails as a whole is reported
+and left out of the checkpoint. Completed chunks are recorded in a checkpoint
+file so an interrupted load can be resumed with the same command (not for
+--sqlite :memory:, which starts empty on every run).
+
+    python -m scripts.load_products --products amazon_products.csv --categories amazon_categories.csv
+    python -m scripts.load_products --products sample.csv --sqlite :memory: --create-schema
+"""
+import os
+import csv
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+import threading
+
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pydantic import ValidationError
+
+from models.productscatalog import ProductsCatalog
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("load_products")
+
+PRODUCT_FIELDS = ["asin", "title", "imgUrl", "productURL", "stars", "price", "category_id"]
+
+# Parametros por consulta IN (SQL Server admite como maximo 2100)
+EXISTING_BATCH_SIZE = 1000
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS amazon.categories (
+        id INTEGER PRIMARY KEY,
+        category_name VARCHAR(255) NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS amazon.products (
+        asin VARCHAR(255) PRIMARY KEY,
+        title VARCHAR(500) NOT NULL,
+        imgUrl VARCHAR(500),
+        productURL VARCHAR(500),
+        stars FLOAT CHECK (stars >= 0 AND stars <= 5),
+        price FLOAT CHECK (price >= 0),
+        category_id INT NOT NULL REFERENCES categories(id)
+    )""",
+]
+
+class SqlServerTarget:
+    """amazon schema on SQL Server, credentials read from Key Vault like the API"""
+
+    insert_products = """
+        INSERT INTO amazon.products (asin, title, imgUrl, productURL, stars, price, category_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    upsert_category = """
+        MERGE amazon.categories AS target
+        USING (SELECT ? AS id, ? AS category_name) AS source
+        ON target.id = source.id
+        WHEN MATCHED THEN UPDATE SET category_name = source.category_name
+        WHEN NOT MATCHED THEN INSERT (id, category_name) VALUES (source.id, source.category_name);
+    """
+
+    # Las filas sobreviven al proceso, asi que el checkpoint sirve para reanudar
+    persistent = True
+
+    def __init__(self, connection_string=None):
+        self.connection_string = connection_string or asyncio.run(self._connection_string_from_keyvault())
+
+    @staticmethod
+    async def _connection_string_from_keyvault():
+        from utils.keyvault import get_secret_by_name
+        names = ["sql-driver", "sql-server", "sql-database", "sql-username", "sql-password"]
+        driver, server, database, username, password = [await get_secret_by_name(name) for name in names]
+        return f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}"
+
+    def connect(self):
+        import pyodbc
+        return pyodbc.connect(self.connection_string, timeout=10)
+
+    def write_categories(self, conn, categories):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET IDENTITY_INSERT amazon.categories ON")
+            cursor.fast_executemany = True
+            cursor.executemany(self.upsert_category, categories)
+            cursor.execute("SET IDENTITY_INSERT amazon.categories OFF")
+            conn.commit()
+        finally:
+            cursor.close()
+
+    def category_ids(self, conn):
+        return _category_ids(conn)
+
+    def existing_asins(self, conn, asins):
+        return _existing_asins(conn, asins)
+
+    def write_products(self, conn, rows):
+        return _insert_rows(conn, self.insert_products, rows, fast=True)
+
+class SqliteTarget:
+    """Local stand-in: the same amazon.* tables in an attached SQLite database"""
+
+    # Sin OR IGNORE: las filas que violan una restriccion fallan igual que en SQL Server
+    insert_products = """
+        INSERT INTO amazon.products (asin, title, imgUrl, productURL, stars, price, category_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    upsert_category = "INSERT OR REPLACE INTO amazon.categories (id, category_name) VALUES (?, ?)"
+
+    def __init__(self, path):
+        self.persistent = path != ":memory:"
+        # ":memory:" se comparte entre hilos con una base en memoria con nombre
+        self.uri = "file:amazon_loader?mode=memory&cache=shared" if path == ":memory:" else path
+        self._keepalive = self.connect() if path == ":memory:" else None
+        # SQLite admite un solo escritor; los workers siguen mapeando y validando en paralelo
+        self._write_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect("file::memory:", uri=True, timeout=30, check_same_thread=False)
+        uri = self.uri if self.uri.startswith("file:") else f"file:{self.uri}"
+        conn.execute("ATTACH DATABASE ? AS amazon", (uri,))
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def create_schema(self, conn):
+        for statement in SQLITE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+
+    def write_categories(self, conn, categories):
+        with self._write_lock:
+            conn.executemany(self.upsert_category, categories)
+            conn.commit()
+
+    def category_ids(self, conn):
+        return _category_ids(conn)
+
+    def existing_asins(self, conn, asins):
+        return _existing_asins(conn, asins)
+
+    def write_products(self, conn, rows):
+        with self._write_lock:
+            return _insert_rows(conn, self.insert_products, rows)
+
+def _category_ids(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM amazon.categories")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def _existing_asins(conn, asins):
+    """Asins already in amazon.products; a resumed load skips them instead of failing"""
+    existing = set()
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(asins), EXISTING_BATCH_SIZE):
+            batch = asins[start:start + EXISTING_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            cursor.execute(f"SELECT asin FROM amazon.products WHERE asin IN ({placeholders})", batch)
+            existing.update(row[0] for row in cursor.fetchall())
+    finally:
+        cursor.close()
+    return existing
+
+def _insert_rows(conn, sql, rows, fast=False):
+    """
+    Inserts ``rows`` in one transaction. If the batch fails it is rolled back and
+    retried row by row; returns ``(position, error)`` for the rows not inserted.
+    """
+    cursor = conn.cursor()
+    try:
+        if fast:
+            cursor.fast_executemany = True
+        try:
+            cursor.executemany(sql, rows)
+            conn.commit()
+            return []
+        except Exception as e:
+            logger.debug(f"Batch of {len(rows)} rows rejected, retrying row by row: {e}")
+            conn.rollback()
+
+        errors = []
+        for position, row in enumerate(rows):
+            try:
+                cursor.execute(sql, row)
+            except Exception as e:
+                errors.append((position, str(e)))
+        conn.commit()
+        return errors
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def check_row(product: tuple, category_ids) -> str | None:
+    """Constraints of amazon.products that ProductsCatalog does not enforce"""
+    asin, title, _, _, stars, price, category_id = product
+    if not asin:
+        return "asin is required"
+    if not title:
+        return "title is required"
+    if stars is not None and not 0 <= stars <= 5:
+        return f"stars must be between 0 and 5 (got {stars})"
+    if price is not None and price < 0:
+        return f"price must not be negative (got {price})"
+    if category_ids is not None and category_id not in category_ids:
+        return f"unknown category_id {category_id}"
+    return None
+
+def _clean(value):
+    value = value.strip() if isinstance(value, str) else value
+    return value if value not in ("", None) else None
+
+def map_row(row: dict) -> tuple:
+    """Maps one CSV row onto the ProductsCatalog fields, in PRODUCT_FIELDS order"""
+    product = ProductsCatalog.model_validate({field: _clean(row.get(field)) for field in PRODUCT_FIELDS})
+    return tuple(getattr(product, field) for field in PRODUCT_FIELDS)
+
+def read_chunks(path, chunk_size):
+    with open(path, newline="", encoding="utf-8") as source:
+        reader = csv.DictReader(source)
+        number = 0
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield number, rows
+            number += 1
+
+def read_categories(path):
+    with open(path, newline="", encoding="utf-8") as source:
+        return [(int(row["id"]), row["category_name"].strip()) for row in csv.DictReader(source) if row.get("id")]
+
+class Checkpoint:
+    """Chunks already committed, stored as JSON next to the source file"""
+
+    def __init__(self, path, source, chunk_size):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.chunk_size = chunk_size
+        self.completed = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as stored:
+                data = json.load(stored)
+            if data.get("source") != self.source or data.get("chunk_size") != chunk_size:
+                raise SystemExit(f"Checkpoint {path} belongs to another source or chunk size; delete it to start over")
+            self.completed = set(data.get("completed", []))
+
+    def mark(self, number):
+        self.completed.add(number)
+        if not self.path:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as stored:
+            json.dump({"source": self.source, "chunk_size": self.chunk_size, "completed": sorted(self.completed)}, stored)
+        os.replace(temporary, self.path)
+
+class Loader:
+    def __init__(self, target, workers=4, chunk_size=5000, checkpoint=None, rejects=None):
+        self.target = target
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._category_ids = None
+
+    def _connection(self):
+        # Una conexion por hilo de trabajo
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.target.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _load_chunk(self, number, rows):
+        """Returns the chunk number, the rows inserted, the rows already present and ``(asin, error)`` per rejected row"""
+        products, errors = [], []
+        for row in rows:
+            try:
+                product = map_row(row)
+            except ValidationError as e:
+                errors.append((row.get("asin"), "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())))
+                continue
+            problem = check_row(product, self._category_ids)
+            if problem:
+                errors.append((product[0], problem))
+            else:
+                products.append(product)
+
+        existing = 0
+        if products:
+            conn = self._connection()
+            #Al reanudar, las filas de un lote ya confirmado se saltan en vez de fallar
+            present = self.target.existing_asins(conn, [product[0] for product in products])
+            if present:
+                existing = sum(1 for product in products if product[0] in present)
+                products = [product for product in products if product[0] not in present]
+            if products:
+                insert_errors = self.target.write_products(conn, products)
+                errors.extend((products[position][0], error) for position, error in insert_errors)
+                inserted = len(products) - len(insert_errors)
+                return number, inserted, existing, errors
+        return number, 0, existing, errors
+
+    def load_categories(self, path):
+        categories = read_categories(path)
+        self.target.write_categories(self._connection(), categories)
+        logger.info(f"{len(categories)} categories upserted")
+        return len(categories)
+
+    def load_products(self, path):
+        started = time.monotonic()
+        self._category_ids = self.target.category_ids(self._connection())
+        totals = {"loaded": 0, "existing": 0, "rejected": 0, "skipped": 0, "failed_chunks": []}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="loader") as executor:
+            pending = {}
+            for number, rows in read_chunks(path, self.chunk_size):
+                if self.checkpoint and number in self.checkpoint.completed:
+                    totals["skipped"] += len(rows)
+                    continue
+                pending[executor.submit(self._load_chunk, number, rows)] = (number, len(rows))
+
+                # Como maximo dos lotes por worker en memoria
+                if len(pending) >= self.workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, pending, totals, started)
+
+            done, _ = wait(pending)
+            self._collect(done, pending, totals, started)
+
+        elapsed = time.monotonic() - started
+        failed = totals["failed_chunks"]
+        logger.info(f"Done: {totals['loaded']} rows inserted, {totals['existing']} already present, "
+                    f"{totals['rejected']} rejected, {totals['skipped']} skipped from checkpoint"
+                    + (f", {len(failed)} chunks failed ({', '.join(map(str, sorted(failed)))}), rerun to retry them" if failed else "")
+                    + f" in {elapsed:.1f}s ({totals['loaded'] / elapsed if elapsed else 0:.0f} rows/s)")
+        totals["failed_chunks"] = sorted(failed)
+        totals["seconds"] = round(elapsed, 3)
+        return totals
+
+    def _collect(self, done, pending, totals, started):
+        for future in done:
+            number, size = pending.pop(future)
+            try:
+                number, inserted, existing, errors = future.result()
+            except Exception as e:
+                # El lote no se marca en el checkpoint: se reintenta al repetir el comando
+                logger.error(f"Chunk {number} failed ({size} rows), continuing: {e}")
+                totals["failed_chunks"].append(number)
+                continue
+            if self.checkpoint:
+                self.checkpoint.mark(number)
+            totals["loaded"] += inserted
+            totals["existing"] += existing
+            totals["rejected"] += len(errors)
+            self._report(number, errors)
+            elapsed = time.monotonic() - started
+            logger.info(f"Chunk {number} committed - {inserted} inserted, {len(errors)} rejected - "
+                        f"{totals['loaded']} rows loaded ({totals['loaded'] / elapsed if elapsed else 0:.0f} rows/s)")
+
+    def _report(self, number, errors):
+        for asin, error in errors[:5]:
+            logger.warning(f"Chunk {number}: row {asin} rejected: {error}")
+        if len(errors) > 5:
+            logger.warning(f"Chunk {number}: {len(errors) - 5} more rows rejected"
+                           + (f" (see {self.rejects})" if self.rejects else ""))
+        if self.rejects and errors:
+            with open(self.rejects, "a", encoding="utf-8") as report:
+                for asin, error in errors:
+                    report.write(json.dumps({"chunk": number, "asin": asin, "error": error}) + "\n")
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the Amazon products CSV into amazon.products")
+    parser.add_argument("--products", required=True, help="Products CSV (asin,title,imgUrl,productURL,stars,price,category_id,...)")
+    parser.add_argument("--categories", help="Categories CSV (id,category_name), upserted before the products")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <products>.checkpoint)")
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not read or write a checkpoint")
+    parser.add_argument("--rejects", help="Append every rejected row (chunk, asin, error) to this NDJSON file")
+    parser.add_argument("--sqlite", help="Load into a SQLite database (path or :memory:) instead of SQL Server")
+    parser.add_argument("--create-schema", action="store_true", help="Create the amazon tables (SQLite only)")
+    parser.add_argument("--connection-string", default=os.getenv("SQL_CONNECTION_STRING"),
+                        help="ODBC connection string (default: built from Key Vault secrets)")
+    args = parser.parse_args(argv)
+
+    target = SqliteTarget(args.sqlite) if args.sqlite else SqlServerTarget(args.connection_string)
+    if args.create_schema:
+        if not args.sqlite:
+            parser.error("--create-schema is only supported with --sqlite")
+        conn = target.connect()
+        target.create_schema(conn)
+        conn.close()
+
+    checkpoint = None
+    if not target.persistent:
+        # La base en memoria empieza vacia en cada ejecucion: un checkpoint saltaria todos los lotes
+        if args.checkpoint:
+            logger.warning("--checkpoint ignored: the target does not outlive this run")
+    elif not args.no_checkpoint:
+        checkpoint = Checkpoint(args.checkpoint or f"{args.products}.checkpoint", args.products, args.chunk_size)
+
+    loader = Loader(target, workers=args.workers, chunk_size=args.chunk_size, checkpoint=checkpoint,
+                    rejects=args.rejects)
+    try:
+        if args.categories:
+            loader.load_categories(args.categories)
+        return loader.load_products(args.products)
+    finally:
+        loader.close()
+
+if __name__ == "__main__":
+    main()
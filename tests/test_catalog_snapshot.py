@@ -0,0 +1,12 @@
+from utils.catalog_snapshot import CatalogSnapshot
+
+PRODUCTS = [
+    {"asin": "A1", "title": "one", "imgUrl": None, "productURL": None, "stars": 4.0, "price": 10.0, "category_id": 1},
+    {"asin": "A2", "title": "two", "imgUrl": None, "productURL": None, "stars": 3.0, "price": 20.0, "category_id": 2},
+]
+
+def test_query_ignores_category_ids_outside_int32():
+    snapshot = CatalogSnapshot.from_products(PRODUCTS)
+    assert snapshot.query(categories=[99999999999]) == (0, [])
+    total, rows = snapshot.query(categories=[2, 99999999999, -2**40])
+    assert total == 1 and rows[0]["asin"] == "A2"
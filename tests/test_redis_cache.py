@@ -0,0 +1,58 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from utils import redis_cache
+
+TAG = "query:table:amazon.products"
+
+@pytest.fixture
+def client():
+    client = fakeredis.FakeAsyncRedis()
+    redis_cache._client = client
+    redis_cache._local_cache.clear()
+    redis_cache._local_groups.clear()
+    redis_cache._generations.clear()
+    redis_cache._building.clear()
+    redis_cache._building_groups.clear()
+    yield client
+    redis_cache._client = None
+
+async def _wait_subscribed(client) -> None:
+    for _ in range(100):
+        if dict(await client.pubsub_numsub(redis_cache.CACHE_INVALIDATION_CHANNEL)).get(
+                redis_cache.CACHE_INVALIDATION_CHANNEL.encode(), 0):
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("invalidation listener did not subscribe")
+
+def test_write_then_read_rebuilds_once_and_stays_fresh(client):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        # La reconstruccion sigue en curso cuando llega el eco de la invalidacion
+        await asyncio.sleep(0.3)
+        return {"rows": len(calls)}
+
+    async def scenario():
+        redis_cache.start_cache_invalidation_listener()
+        try:
+            await _wait_subscribed(client)
+            await redis_cache.get_or_build(client, "page", loader, 60, groups=[TAG], serve_stale=False)
+
+            # Escritura seguida de una lectura
+            await redis_cache.invalidate_cache_groups(client, [TAG])
+            value = await redis_cache.get_or_build(client, "page", loader, 60, groups=[TAG], serve_stale=False)
+            assert value == {"rows": 2}
+            assert await client.ttl("fresh:page") > 0
+
+            await asyncio.sleep(0.2)
+            value = await redis_cache.get_or_build(client, "page", loader, 60, groups=[TAG], serve_stale=False)
+            assert value == {"rows": 2}
+        finally:
+            await redis_cache.stop_cache_invalidation_listener()
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Optional
+
+from utils.metrics import observe
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack" if msgpack else "json")
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd" if zstandard else "zlib")
+CACHE_COMPRESSION_MIN_BYTES = int(os.getenv("CACHE_COMPRESSION_MIN_BYTES", "1024"))
+CACHE_COMPRESSION_LEVEL = int(os.getenv("CACHE_COMPRESSION_LEVEL", "3"))
+CACHE_CHUNK_SIZE = int(os.getenv("CACHE_CHUNK_SIZE", str(512 * 1024)))
+CACHE_CODEC_STATS_KEYS = int(os.getenv("CACHE_CODEC_STATS_KEYS", "500"))
+
+# Cabecera de 3 bytes: marca, formato y compresion. Un JSON nunca empieza con \x00,
+# asi los valores escritos antes del codec se siguen leyendo como JSON
+MAGIC = 0
+MANIFEST = 0xFF
+FORMATS = {"json": 1, "msgpack": 2}
+COMPRESSIONS = {"none": 0, "zlib": 1, "zstd": 2}
+
+class CacheCodecError(ValueError):
+    pass
+
+def _serialize(data: Any, format_id: int) -> bytes:
+    if format_id == FORMATS["msgpack"]:
+        return msgpack.packb(data, default=str)
+    return json.dumps(data, default=str, separators=(",", ":")).encode("utf-8")
+
+def _deserialize(payload: bytes, format_id: int) -> Any:
+    if format_id == FORMATS["msgpack"]:
+        if msgpack is None:
+            raise CacheCodecError("msgpack value found but msgpack is not installed")
+        return msgpack.unpackb(payload)
+    return json.loads(payload)
+
+def _compress(payload: bytes, compression_id: int) -> bytes:
+    if compression_id == COMPRESSIONS["zstd"]:
+        return zstandard.ZstdCompressor(level=CACHE_COMPRESSION_LEVEL).compress(payload)
+    if compression_id == COMPRESSIONS["zlib"]:
+        return zlib.compress(payload, CACHE_COMPRESSION_LEVEL)
+    return payload
+
+def _decompress(payload: bytes, compression_id: int) -> bytes:
+    if compression_id == COMPRESSIONS["zstd"]:
+        if zstandard is None:
+            raise CacheCodecError("zstd value found but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if compression_id == COMPRESSIONS["zlib"]:
+        return zlib.decompress(payload)
+    return payload
+
+class CodecStats:
+    """Per-key sizes and encode/decode timings, bounded to the most recent keys"""
+
+    def __init__(self, max_keys=CACHE_CODEC_STATS_KEYS):
+        self.max_keys = max_keys
+        self._keys: OrderedDict[str, dict] = OrderedDict()
+
+    def _entry(self, key: str) -> dict:
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = {
+                "serialized_bytes": 0, "stored_bytes": 0, "chunks": 1,
+                "encodes": 0, "encode_ms": 0.0, "decodes": 0, "decode_ms": 0.0,
+            }
+            if len(self._keys) > self.max_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(key)
+        return entry
+
+    def record_encode(self, key: str, serialized: int, stored: int, chunks: int, seconds: float) -> None:
+        entry = self._entry(key)
+        entry.update(serialized_bytes=serialized, stored_bytes=stored, chunks=chunks)
+        entry["encodes"] += 1
+        entry["encode_ms"] += seconds * 1000
+
+    def record_decode(self, key: str, stored: int, seconds: float) -> None:
+        entry = self._entry(key)
+        entry["stored_bytes"] = stored
+        entry["decodes"] += 1
+        entry["decode_ms"] += seconds * 1000
+
+    def snapshot(self) -> dict:
+        keys = {}
+        for key, entry in self._keys.items():
+            keys[key] = {
+                **entry,
+                "ratio": round(entry["stored_bytes"] / entry["serialized_bytes"], 3) if entry["serialized_bytes"] else None,
+                "encode_ms": round(entry["encode_ms"] / entry["encodes"], 3) if entry["encodes"] else None,
+                "decode_ms": round(entry["decode_ms"] / entry["decodes"], 3) if entry["decodes"] else None,
+            }
+        return {"format": CACHE_CODEC, "compression": CACHE_COMPRESSION, "keys": keys}
+
+class CacheCodec:
+    """
+    Turns cache values into bytes for Redis and back.
+
+    Values are serialized with ``format`` (msgpack or JSON), compressed with
+    ``compression`` when larger than ``min_bytes``, and prefixed with a small
+    header so any worker can decode them whatever its own settings are. Blobs
+    bigger than ``chunk_size`` are meant to be stored in several keys; see
+    ``split`` and ``manifest``.
+    """
+
+    def __init__(self, format=CACHE_CODEC, compression=CACHE_COMPRESSION,
+                 min_bytes=CACHE_COMPRESSION_MIN_BYTES, chunk_size=CACHE_CHUNK_SIZE):
+        if format not in FORMATS or (format == "msgpack" and msgpack is None):
+            logger.warning(f"Cache codec '{format}' not available, using json")
+            format = "json"
+        if compression not in COMPRESSIONS or (compression == "zstd" and zstandard is None):
+            logger.warning(f"Cache compression '{compression}' not available, using zlib")
+            compression = "zlib"
+        self.format_id = FORMATS[format]
+        self.compression_id = COMPRESSIONS[compression]
+        self.min_bytes = min_bytes
+        self.chunk_size = chunk_size
+        self.stats = CodecStats()
+
+    def encode(self, key: str, data: Any) -> bytes:
+        started = time.perf_counter()
+        payload = _serialize(data, self.format_id)
+        compression_id = self.compression_id if len(payload) >= self.min_bytes else COMPRESSIONS["none"]
+        blob = bytes((MAGIC, self.format_id, compression_id)) + _compress(payload, compression_id)
+        elapsed = time.perf_counter() - started
+        self.stats.record_encode(key, len(payload), len(blob), self.chunk_count(blob), elapsed)
+        observe("cache.encode", elapsed)
+        return blob
+
+    def decode(self, key: str, blob: bytes) -> Any:
+        started = time.perf_counter()
+        if not blob or blob[0] != MAGIC:
+            # Valor JSON anterior al codec
+            data = json.loads(blob)
+        else:
+            if len(blob) < 3 or blob[1] == MANIFEST:
+                raise CacheCodecError(f"Invalid cache value header for key '{key}'")
+            try:
+                data = _deserialize(_decompress(blob[3:], blob[2]), blob[1])
+            except CacheCodecError:
+                raise
+            except Exception as e:
+                raise CacheCodecError(f"Corrupted cache value for key '{key}': {e}") from e
+        elapsed = time.perf_counter() - started
+        self.stats.record_decode(key, len(blob), elapsed)
+        observe("cache.decode", elapsed)
+        return data
+
+    def fingerprint(self, data: Any) -> str:
+        """Content hash of a value, the same in every worker using the same format"""
+        return hashlib.blake2b(_serialize(data, self.format_id), digest_size=12).hexdigest()
+
+    def chunk_count(self, blob: bytes) -> int:
+        return max(1, -(-len(blob) // self.chunk_size))
+
+    def split(self, blob: bytes) -> list[bytes]:
+        return [blob[start:start + self.chunk_size] for start in range(0, len(blob), self.chunk_size)]
+
+    @staticmethod
+    def manifest(version: str, chunks: int) -> bytes:
+        """Value stored under the main key of a chunked entry"""
+        return bytes((MAGIC, MANIFEST, 0)) + json.dumps({"version": version, "chunks": chunks}).encode("utf-8")
+
+    @staticmethod
+    def read_manifest(blob: bytes) -> Optional[dict]:
+        if len(blob) > 3 and blob[0] == MAGIC and blob[1] == MANIFEST:
+            return json.loads(blob[3:])
+        return None
+
+    @staticmethod
+    def chunk_key(key: str, version: str, number: int) -> str:
+        return f"{key}:chunk:{version}:{number}"
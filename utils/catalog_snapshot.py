@@ -0,0 +1,500 @@
+import os
+import sys
+import mmap
+import bisect
+import struct
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+import numpy as np
+
+from utils.database import stream_query
+from utils.metrics import span
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_REFRESH = float(os.getenv("CATALOG_SNAPSHOT_REFRESH", "900"))
+
+# Con varios workers (WEB_CONCURRENCY, el mismo valor que lee uvicorn) el snapshot se publica
+# una sola vez en un archivo mapeado en memoria que todos los workers leen sin copiarlo
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+CATALOG_SNAPSHOT_SHARED = os.getenv("CATALOG_SNAPSHOT_SHARED", "auto").lower()
+CATALOG_SNAPSHOT_PATH = os.getenv(
+    "CATALOG_SNAPSHOT_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "amazonapi-catalog.snap")
+)
+
+TEXT_FIELDS = ("asin", "title", "imgUrl", "productURL")
+NUMERIC_FIELDS = (("price", "<f8"), ("stars", "<f8"), ("category_id", "<i4"))
+
+SNAPSHOT_MAGIC = b"CATSNAP1"
+_HEADER = struct.Struct("<8sQQ")  # magic, generation, filas
+_GENERATION = struct.Struct("<Q")
+
+def _text(value) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+def _number(value) -> float:
+    return float("nan") if value is None else float(value)
+
+class CatalogSnapshot:
+    """
+    Columnar, read-only copy of amazon.products ordered by asin.
+
+    price, stars and category_id are NumPy arrays (missing numbers are NaN) and
+    the text columns are object arrays of interned strings. Filters and sorting
+    are evaluated with vectorized masks; only the requested page is turned back
+    into dicts.
+    """
+
+    def __init__(self, columns: dict[str, np.ndarray]):
+        self.columns = columns
+        self.asin = columns["asin"]
+        self.price = columns["price"]
+        self.stars = columns["stars"]
+        self.category_id = columns["category_id"]
+
+    def __len__(self) -> int:
+        return len(self.asin)
+
+    @staticmethod
+    def _column_arrays(products: list[dict]) -> dict[str, np.ndarray]:
+        columns = {}
+        for field in TEXT_FIELDS:
+            column = np.empty(len(products), dtype=object)
+            column[:] = [_text(product.get(field)) for product in products]
+            columns[field] = column
+        columns["price"] = np.array([_number(product.get("price")) for product in products], dtype=np.float64)
+        columns["stars"] = np.array([_number(product.get("stars")) for product in products], dtype=np.float64)
+        columns["category_id"] = np.array([product["category_id"] for product in products], dtype=np.int32)
+        return columns
+
+    @classmethod
+    def from_products(cls, products: list[dict]) -> "CatalogSnapshot":
+        products = sorted(products, key=lambda product: product["asin"])
+        return cls(cls._column_arrays(products))
+
+    def with_products(self, products: list[dict]) -> "CatalogSnapshot":
+        """Returns a new snapshot with the given products inserted in asin order (existing asins are replaced)"""
+        products = sorted({product["asin"]: product for product in products if product.get("asin")}.values(),
+                          key=lambda product: product["asin"])
+        if not products:
+            return self
+
+        added = self._column_arrays(products)
+        keep = ~np.isin(self.asin, added["asin"])
+        base = {name: column[keep] for name, column in self.columns.items()}
+        positions = np.searchsorted(base["asin"], added["asin"])
+        return CatalogSnapshot({name: np.insert(base[name], positions, added[name]) for name in base})
+
+    def query(
+        self,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        min_stars: Optional[float] = None,
+        categories: Optional[Iterable[int]] = None,
+        sort: str = "asin",
+        descending: bool = False,
+        limit: int = 100,
+        offset: int = 0
+    ) -> tuple[int, list[dict]]:
+        """Returns the total number of matches and one page of products"""
+        mask = np.ones(len(self), dtype=bool)
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if min_stars is not None:
+            mask &= self.stars >= min_stars
+        if categories:
+            # Un id fuera de int32 no puede estar en la columna; no coincide con nada
+            limits = np.iinfo(np.int32)
+            wanted = [category for category in categories if limits.min <= category <= limits.max]
+            mask &= np.isin(self.category_id, np.array(wanted, dtype=np.int32))
+
+        matches = np.flatnonzero(mask)
+        total = len(matches)
+        wanted = offset + limit
+        if offset >= total:
+            return total, []
+
+        if sort == "asin":
+            # El snapshot ya esta ordenado por asin
+            page = matches[::-1] if descending else matches
+        else:
+            keys = self.columns[sort][matches]
+            keys = -keys if descending else keys.copy()
+            # Los valores faltantes siempre al final
+            keys[np.isnan(keys)] = np.inf
+            if wanted < total:
+                # Top-N: solo se ordenan las filas que pueden entrar en la pagina
+                threshold = np.partition(keys, wanted - 1)[wanted - 1]
+                selected = keys <= threshold
+                matches, keys = matches[selected], keys[selected]
+            page = matches[np.lexsort((matches, keys))]
+
+        return total, [self._row(position) for position in page[offset:wanted]]
+
+    def _row(self, position: int) -> dict:
+        row = {field: self.columns[field][position] for field in TEXT_FIELDS}
+        price = self.price[position]
+        stars = self.stars[position]
+        row["price"] = None if np.isnan(price) else float(price)
+        row["stars"] = None if np.isnan(stars) else float(stars)
+        row["category_id"] = int(self.category_id[position])
+        return row
+
+class _TextColumn:
+    """Read-only UTF-8 column of a shared snapshot, decoded one value at a time"""
+    __slots__ = ("_nulls", "_offsets", "_blob")
+
+    def __init__(self, nulls: np.ndarray, offsets: np.ndarray, blob: memoryview):
+        self._nulls = nulls
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._nulls)
+
+    def __getitem__(self, position: int) -> Optional[str]:
+        if self._nulls[position]:
+            return None
+        return str(self._blob[self._offsets[position]:self._offsets[position + 1]], "utf-8")
+
+    def segment(self, start: int, end: int) -> tuple[np.ndarray, np.ndarray, memoryview]:
+        """Null flags, byte lengths and raw bytes of rows [start, end)"""
+        offsets = self._offsets[start:end + 1]
+        return self._nulls[start:end], np.diff(offsets), self._blob[offsets[0]:offsets[-1]]
+
+    def to_array(self) -> np.ndarray:
+        blob = bytes(self._blob)
+        offsets = self._offsets.tolist()
+        column = np.empty(len(self), dtype=object)
+        column[:] = [None if null else sys.intern(blob[offsets[position]:offsets[position + 1]].decode("utf-8"))
+                     for position, null in enumerate(self._nulls.tolist())]
+        return column
+
+class SharedCatalogSnapshot(CatalogSnapshot):
+    """
+    Snapshot mapped from the shared file: the numeric columns are NumPy views
+    over the mapping and the text columns are decoded only for the rows of the
+    requested page, so every worker reads the same pages of memory.
+    """
+
+    def __init__(self, columns: dict, generation: int):
+        super().__init__(columns)
+        self.generation = generation
+
+    def materialize(self) -> CatalogSnapshot:
+        return CatalogSnapshot({
+            name: column.to_array() if isinstance(column, _TextColumn) else np.array(column)
+            for name, column in self.columns.items()
+        })
+
+    def with_products(self, products: list[dict]) -> CatalogSnapshot:
+        return self.materialize().with_products(products)
+
+    def serialize_with(self, products: list[dict], generation: int) -> bytes:
+        """
+        Serializes this snapshot with ``products`` inserted in asin order (existing
+        asins are replaced) by splicing the mapped buffers: only the new rows are
+        encoded, every other row is copied as raw bytes.
+        """
+        products = sorted({product["asin"]: product for product in products if product.get("asin")}.values(),
+                          key=lambda product: product["asin"])
+        # Tramos de filas existentes que se conservan; despues del tramo i va el producto nuevo i
+        runs = []
+        cursor = 0
+        for product in products:
+            position = bisect.bisect_left(self.asin, product["asin"])
+            runs.append((cursor, position))
+            replaced = position < len(self) and self.asin[position] == product["asin"]
+            cursor = position + 1 if replaced else position
+        runs.append((cursor, len(self)))
+        added = self._column_arrays(products)
+
+        def interleave(existing, new) -> list:
+            parts = []
+            for index, (start, end) in enumerate(runs):
+                parts.append(existing(start, end))
+                if index < len(products):
+                    parts.append(new(index))
+            return parts
+
+        numeric = {
+            name: np.concatenate(interleave(lambda start, end: self.columns[name][start:end],
+                                            lambda index: added[name][index:index + 1]))
+            for name, _ in NUMERIC_FIELDS
+        }
+        text = {}
+        for field in TEXT_FIELDS:
+            parts = interleave(self.columns[field].segment, lambda index: _encode_text(added[field][index:index + 1]))
+            text[field] = (
+                np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]),
+                b"".join(part[2] for part in parts),
+            )
+        return _pack(generation, len(numeric["price"]), numeric, text)
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def _pad(buffer: bytearray) -> None:
+    buffer.extend(b"\0" * (_aligned(len(buffer)) - len(buffer)))
+
+def _encode_text(values) -> tuple[np.ndarray, np.ndarray, bytes]:
+    """Null flags, byte lengths and concatenated UTF-8 bytes of optional strings"""
+    encoded = [value.encode("utf-8") if value is not None else b"" for value in values]
+    nulls = np.fromiter((value is None for value in values), dtype=np.uint8, count=len(encoded))
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    return nulls, lengths, b"".join(encoded)
+
+def _pack(generation: int, rows: int, numeric: dict, text: dict) -> bytes:
+    """
+    Flat layout: header, the numeric columns as little-endian arrays, then per
+    text column a null flag per row, n+1 offsets and the UTF-8 bytes. Every
+    section starts on an 8-byte boundary so it can be mapped as a NumPy array.
+    """
+    buffer = bytearray(_HEADER.pack(SNAPSHOT_MAGIC, generation, rows))
+    for name, dtype in NUMERIC_FIELDS:
+        buffer += np.ascontiguousarray(numeric[name], dtype=dtype).tobytes()
+        _pad(buffer)
+    for field in TEXT_FIELDS:
+        nulls, lengths, blob = text[field]
+        offsets = np.zeros(rows + 1, dtype="<i8")
+        np.cumsum(lengths, out=offsets[1:])
+        buffer += np.ascontiguousarray(nulls, dtype=np.uint8).tobytes()
+        _pad(buffer)
+        buffer += offsets.tobytes()
+        buffer += blob
+        _pad(buffer)
+    return bytes(buffer)
+
+def serialize_snapshot(snapshot: CatalogSnapshot, generation: int) -> bytes:
+    numeric = {name: snapshot.columns[name] for name, _ in NUMERIC_FIELDS}
+    text = {field: _encode_text(snapshot.columns[field]) for field in TEXT_FIELDS}
+    return _pack(generation, len(snapshot), numeric, text)
+
+def map_snapshot(path: str) -> SharedCatalogSnapshot:
+    """Maps a file written by serialize_snapshot read-only, without copying its columns"""
+    with open(path, "rb") as source:
+        buffer = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, generation, rows = _HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a catalog snapshot")
+
+    view = memoryview(buffer)
+    offset = _HEADER.size
+    columns = {}
+    for name, dtype in NUMERIC_FIELDS:
+        columns[name] = np.frombuffer(view, dtype=dtype, count=rows, offset=offset)
+        offset = _aligned(offset + columns[name].nbytes)
+    for field in TEXT_FIELDS:
+        nulls = np.frombuffer(view, dtype=np.uint8, count=rows, offset=offset)
+        offset = _aligned(offset + rows)
+        offsets = np.frombuffer(view, dtype="<i8", count=rows + 1, offset=offset)
+        offset += offsets.nbytes
+        size = int(offsets[-1])
+        columns[field] = _TextColumn(nulls, offsets, view[offset:offset + size])
+        offset = _aligned(offset + size)
+    # El orden de las llaves es el mismo que en CatalogSnapshot
+    return SharedCatalogSnapshot({name: columns[name] for name in (*TEXT_FIELDS, "price", "stars", "category_id")}, generation)
+
+class SharedSnapshotStore:
+    """
+    Catalog snapshot shared by every worker of the host through a memory-mapped file.
+
+    ``<path>`` holds the current snapshot and ``<path>.gen`` its generation
+    (8 bytes mapped by every reader). A new generation is written to a temporary
+    file and renamed over ``<path>``, then the counter is bumped: readers compare
+    the counter on each access and map the new file, so a swap is atomic for all
+    workers and a reader never sees a partial snapshot. Writers are serialized
+    with ``<path>.lock``; ``<path>.leader`` elects the one worker that rebuilds
+    the snapshot from SQL.
+    """
+
+    def __init__(self, path: str = CATALOG_SNAPSHOT_PATH):
+        self.path = path
+        self._control: Optional[mmap.mmap] = None
+        self._current: Optional[SharedCatalogSnapshot] = None
+        self._leader_fd: Optional[int] = None
+
+    def _open_control(self) -> mmap.mmap:
+        if self._control is None:
+            fd = os.open(f"{self.path}.gen", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _GENERATION.size:
+                    os.ftruncate(fd, _GENERATION.size)
+                self._control = mmap.mmap(fd, _GENERATION.size)
+            finally:
+                os.close(fd)
+        return self._control
+
+    def generation(self) -> int:
+        return _GENERATION.unpack_from(self._open_control(), 0)[0]
+
+    def current(self) -> Optional[SharedCatalogSnapshot]:
+        """Snapshot of the latest generation, re-mapped only when the counter moved"""
+        generation = self.generation()
+        if generation == 0:
+            return None
+        if self._current is None or self._current.generation < generation:
+            try:
+                self._current = map_snapshot(self.path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to map catalog snapshot generation {generation}: {e}")
+        return self._current
+
+    @contextmanager
+    def write_lock(self):
+        fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _publish(self, serialize) -> SharedCatalogSnapshot:
+        # Se llama con write_lock tomado; serialize(generation) devuelve el contenido del archivo
+        with span("snapshot.publish"):
+            generation = self.generation() + 1
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as target:
+                target.write(serialize(generation))
+            os.replace(temporary, self.path)
+            _GENERATION.pack_into(self._open_control(), 0, generation)
+        return self.current()
+
+    def replace(self, snapshot: CatalogSnapshot, since_generation: int) -> SharedCatalogSnapshot:
+        """
+        Publishes a snapshot rebuilt from SQL. Products that other workers added
+        after ``since_generation`` (while the table was being read) are carried
+        over; the catalog is append-only, so any asin missing from the rebuild is one of them.
+        """
+        with self.write_lock():
+            current = self.current()
+            if current is not None and current.generation != since_generation:
+                missing = np.flatnonzero(~np.isin(current.asin.to_array(), snapshot.asin))
+                snapshot = snapshot.with_products([current._row(position) for position in missing])
+            return self._publish(lambda generation: serialize_snapshot(snapshot, generation))
+
+    def insert(self, products: list[dict]) -> Optional[SharedCatalogSnapshot]:
+        with self.write_lock():
+            current = self.current()
+            if current is None:
+                # Aun no hay snapshot: el lider lo construye leyendo la tabla
+                return None
+            return self._publish(lambda generation: current.serialize_with(products, generation))
+
+    def try_lead(self) -> bool:
+        if self._leader_fd is not None:
+            return True
+        fd = os.open(f"{self.path}.leader", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._leader_fd = fd
+        logger.info(f"This worker maintains the shared catalog snapshot ({self.path})")
+        return True
+
+    def release(self) -> None:
+        if self._leader_fd is not None:
+            os.close(self._leader_fd)
+            self._leader_fd = None
+
+def _shared_mode() -> bool:
+    enabled = WEB_CONCURRENCY > 1 if CATALOG_SNAPSHOT_SHARED == "auto" else CATALOG_SNAPSHOT_SHARED not in ("0", "false", "no")
+    if enabled and fcntl is None:
+        logger.warning("Shared catalog snapshot needs fcntl; every worker keeps its own copy")
+        return False
+    return enabled
+
+# Snapshot del proceso; None mientras se construye por primera vez
+_snapshot: Optional[CatalogSnapshot] = None
+_building: Optional[list[dict]] = None
+_snapshot_task: Optional[asyncio.Task] = None
+# Con varios workers el snapshot vive en el archivo compartido en lugar de _snapshot
+_store: Optional[SharedSnapshotStore] = SharedSnapshotStore() if _shared_mode() else None
+
+async def build_catalog_snapshot() -> int:
+    """Reads amazon.products into a new snapshot and swaps it in"""
+    global _snapshot, _building
+    products = []
+    _building = []
+    since_generation = _store.generation() if _store is not None else 0
+    try:
+        #Primario: el snapshot se comparte entre workers y no debe perder altas aun no replicadas
+        async for batch in stream_query("SELECT asin, title, imgUrl, productURL, stars, price, category_id FROM amazon.products ORDER BY asin",
+                                        primary=True):
+            products.extend(batch)
+        snapshot = CatalogSnapshot.from_products(products)
+        #Productos creados mientras se leia la tabla
+        snapshot = snapshot.with_products(_building)
+    finally:
+        _building = None
+
+    if _store is not None:
+        snapshot = await asyncio.to_thread(_store.replace, snapshot, since_generation)
+    _snapshot = snapshot
+    logger.info(f"Catalog snapshot built ({len(snapshot)} products)")
+    return len(snapshot)
+
+async def _maintain_catalog_snapshot() -> None:
+    while True:
+        if _store is not None and not _store.try_lead():
+            # Otro worker mantiene el snapshot compartido; se reintenta por si ese worker termina
+            await asyncio.sleep(min(CATALOG_SNAPSHOT_REFRESH, 30))
+            continue
+        try:
+            await build_catalog_snapshot()
+        except Exception as e:
+            logger.warning(f"Failed to build catalog snapshot: {e}")
+            if _snapshot is None:
+                await asyncio.sleep(min(CATALOG_SNAPSHOT_REFRESH, 30))
+                continue
+        await asyncio.sleep(CATALOG_SNAPSHOT_REFRESH)
+
+def start_catalog_snapshot() -> None:
+    global _snapshot_task
+    if _snapshot_task is None or _snapshot_task.done():
+        _snapshot_task = asyncio.create_task(_maintain_catalog_snapshot())
+
+async def stop_catalog_snapshot() -> None:
+    global _snapshot_task
+    if _snapshot_task is not None:
+        _snapshot_task.cancel()
+        try:
+            await _snapshot_task
+        except asyncio.CancelledError:
+            pass
+        _snapshot_task = None
+    if _store is not None:
+        _store.release()
+
+def get_catalog_snapshot() -> Optional[CatalogSnapshot]:
+    if _store is not None:
+        return _store.current()
+    return _snapshot
+
+async def add_to_catalog_snapshot(products: Iterable[dict]) -> None:
+    """Swaps in a copy of the snapshot that includes freshly inserted products (for every worker in shared mode)"""
+    global _snapshot
+    products = list(products)
+    if _building is not None:
+        _building.extend(products)
+    if not products:
+        return
+    if _store is not None:
+        await asyncio.to_thread(_store.insert, products)
+    elif _snapshot is not None:
+        _snapshot = _snapshot.with_products(products)
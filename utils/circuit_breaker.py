@@ -0,0 +1,58 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Stops sending work to a dependency after ``threshold`` consecutive failures.
+
+    While open, callers use their fallback (the database instead of Redis, the
+    primary instead of the read replica). After the cooldown a single probe is
+    let through (half-open); each failed probe doubles the cooldown up to
+    ``max_cooldown``. A probe that never reports back is retried after another
+    cooldown.
+    """
+
+    def __init__(self, name: str, threshold: int, cooldown: float, max_cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+
+    @property
+    def cooldown(self) -> float:
+        return min(self.base_cooldown * 2 ** max(self.trips - 1, 0), self.max_cooldown)
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            if self.state == "open":
+                logger.info(f"{self.name} circuit half-open, probing connection")
+            self.state = "half_open"
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"{self.name} circuit closed, traffic restored")
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            logger.warning(f"⚠️ {self.name} circuit open for {self.cooldown:.0f}s - using fallback")
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "trips": self.trips, "cooldown": self.cooldown}
@@ -1,10 +1,19 @@
 from dotenv import load_dotenv
 import os
+import time
+import asyncio
 import pyodbc
 import logging
 import json
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from utils.keyvault import get_secret_by_name
+from utils.metrics import span, observe, record_db_target
+from utils.circuit_breaker import CircuitBreaker
+from utils.query_cache import query_tables, get_or_query, invalidate_tables
 load_dotenv()
 
 # Configurar logging
@@ -17,74 +26,599 @@ logger = logging.getLogger(__name__)
 #username = os.getenv('SQL_USERNAME')
 #password = os.getenv('SQL_PASSWORD')
 
-async def get_db_connection():
+# Configuracion del pool de conexiones
+SQL_POOL_MIN_SIZE = int(os.getenv('SQL_POOL_MIN_SIZE', '1'))
+SQL_POOL_MAX_SIZE = int(os.getenv('SQL_POOL_MAX_SIZE', '10'))
+SQL_POOL_IDLE_TIMEOUT = float(os.getenv('SQL_POOL_IDLE_TIMEOUT', '300'))
+SQL_POOL_ACQUIRE_TIMEOUT = float(os.getenv('SQL_POOL_ACQUIRE_TIMEOUT', '15'))
+SQL_POOL_HEALTHCHECK_AFTER = float(os.getenv('SQL_POOL_HEALTHCHECK_AFTER', '30'))
+SQL_BULK_CHUNK_SIZE = int(os.getenv('SQL_BULK_CHUNK_SIZE', '500'))
+SQL_STREAM_BATCH_SIZE = int(os.getenv('SQL_STREAM_BATCH_SIZE', '1000'))
+
+# Replica de lectura (ApplicationIntent=ReadOnly): las lecturas con needs_commit=False van a la replica.
+# SQL_REPLICA_SERVER solo hace falta si la replica esta en otro servidor (geo-replica)
+SQL_READ_REPLICA = os.getenv('SQL_READ_REPLICA', 'false').lower() in ('1', 'true', 'yes')
+SQL_REPLICA_SERVER = os.getenv('SQL_REPLICA_SERVER')
+SQL_REPLICA_POOL_MAX_SIZE = int(os.getenv('SQL_REPLICA_POOL_MAX_SIZE', str(SQL_POOL_MAX_SIZE)))
+# Segundos despues de escribir una tabla en los que sus lecturas siguen yendo al primario (read-your-writes)
+SQL_REPLICA_WRITE_FENCE = float(os.getenv('SQL_REPLICA_WRITE_FENCE', '5'))
+SQL_REPLICA_BREAKER_THRESHOLD = int(os.getenv('SQL_REPLICA_BREAKER_THRESHOLD', '3'))
+SQL_REPLICA_BREAKER_COOLDOWN = float(os.getenv('SQL_REPLICA_BREAKER_COOLDOWN', '10'))
+SQL_REPLICA_BREAKER_MAX_COOLDOWN = float(os.getenv('SQL_REPLICA_BREAKER_MAX_COOLDOWN', '300'))
+
+# Un hilo por conexion de ambos pools (mas margen para los connect): las lecturas de la
+# replica no hacen cola detras del trabajo del primario
+SQL_EXECUTOR_WORKERS = int(os.getenv('SQL_EXECUTOR_WORKERS', str(
+    SQL_POOL_MAX_SIZE + (SQL_REPLICA_POOL_MAX_SIZE if SQL_READ_REPLICA else 0) + 2)))
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+# Executor acotado para las llamadas bloqueantes del driver (connect, execute, fetch)
+_executor = ThreadPoolExecutor(max_workers=SQL_EXECUTOR_WORKERS, thread_name_prefix="sql")
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking driver call on the bounded SQL executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+class DatabaseConnectionError(Exception):
+    """The driver could not open a connection to the primary or the replica"""
+
+class PoolTimeoutError(Exception):
+    """No pooled connection became free within the acquire timeout"""
+
+async def get_db_connection(read_only: bool = False):
     driver = await get_secret_by_name('sql-driver')
     server = await get_secret_by_name('sql-server')
     database = await get_secret_by_name('sql-database')
     username = await get_secret_by_name('sql-username')
     password = await get_secret_by_name('sql-password')
-    
+
+    if read_only and SQL_REPLICA_SERVER:
+        server = SQL_REPLICA_SERVER
     connection_string = f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}"
+    if read_only:
+        connection_string += ";ApplicationIntent=ReadOnly"
+    target = REPLICA if read_only else PRIMARY
 
     try:
-        logger.info(f"Intentando conectar a la base de datos...")
-        conn = pyodbc.connect(connection_string, timeout=10)
-        logger.info("Conexión exitosa a la base de datos.")
+        logger.info(f"Intentando conectar a la base de datos ({target})...")
+        with span("db.connect"):
+            conn = await run_blocking(pyodbc.connect, connection_string, timeout=10)
+        logger.info(f"Conexión exitosa a la base de datos ({target}).")
         return conn
     except pyodbc.Error as e:
-        logger.error(f"Error de conexión a la base de datos: {str(e)}")
-        raise Exception(f"Error de conexión a la base de datos: {str(e)}")
+        logger.error(f"Error de conexión a la base de datos ({target}): {str(e)}")
+        raise DatabaseConnectionError(f"Error de conexión a la base de datos: {str(e)}")
     except Exception as e:
          logger.error(f"Error inesperado durante la conexión: {str(e)}")
          raise
 
-async def execute_query_json(sql_template, params=None, needs_commit=False):
-    conn = None
-    cursor = None
+def _is_healthy(conn) -> bool:
     try:
-        conn = await get_db_connection()
         cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+def _close_quietly(conn) -> None:
+    try:
+        conn.close()
+    except pyodbc.Error as e:
+        logger.warning(f"Error cerrando conexión: {e}")
+
+class ConnectionPool:
+    """
+    Async pool of pyodbc connections.
+
+    Connections are checked for health when they have been idle for longer than
+    ``healthcheck_after`` and closed once idle for ``idle_timeout`` (never going
+    below ``min_size``). Checkouts wait at most ``acquire_timeout`` seconds.
+    """
+
+    def __init__(self, connect, min_size=SQL_POOL_MIN_SIZE, max_size=SQL_POOL_MAX_SIZE,
+                 idle_timeout=SQL_POOL_IDLE_TIMEOUT, acquire_timeout=SQL_POOL_ACQUIRE_TIMEOUT,
+                 healthcheck_after=SQL_POOL_HEALTHCHECK_AFTER):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_after = healthcheck_after
+
+        self._idle = deque()  # (conn, last_used), la mas reciente a la derecha
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._size = 0
+        self._waiting = 0
+
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    async def open(self) -> None:
+        """Opens connections until the pool holds ``min_size`` of them."""
+        while self._size < self.min_size:
+            conn = await self._connect()
+            self._size += 1
+            self._created += 1
+            self._idle.append((conn, time.monotonic()))
+
+    async def acquire(self):
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            logger.error(f"Timeout esperando conexión del pool ({self.acquire_timeout}s)")
+            raise PoolTimeoutError("Timeout esperando una conexión a la base de datos")
+        finally:
+            self._waiting -= 1
+
+        wait = time.monotonic() - started
+        observe("db.acquire", wait)
+        self._acquisitions += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+        try:
+            await self._evict_idle()
+            while self._idle:
+                conn, last_used = self._idle.pop()
+                if time.monotonic() - last_used < self.healthcheck_after:
+                    return conn
+                if await run_blocking(_is_healthy, conn):
+                    return conn
+                logger.warning("Conexión inválida descartada del pool.")
+                await self._discard(conn)
+
+            conn = await self._connect()
+            self._size += 1
+            self._created += 1
+            return conn
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def release(self, conn, discard=False) -> None:
+        try:
+            if discard:
+                await self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._semaphore.release()
+
+    async def run(self, func, *args):
+        """
+        Runs ``func(conn, *args)`` on the SQL executor with a pooled connection.
+
+        If the awaiting task is cancelled the driver call keeps running in its
+        thread, so the connection is only returned once that call finishes.
+        """
+        conn = await self.acquire()
+        future = asyncio.ensure_future(run_blocking(func, conn, *args))
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(lambda f: self._release_when_done(conn, f))
+            raise
+        except BaseException as e:
+            # Solo una conexion caida se descarta; tras un error de la consulta se reutiliza
+            await self.release(conn, discard=_is_connection_error(e))
+            raise
+        await self.release(conn)
+        return result
+
+    def _release_when_done(self, conn, future) -> None:
+        broken = future.cancelled() or _is_connection_error(future.exception())
+        asyncio.ensure_future(self.release(conn, discard=broken))
+
+    async def _discard(self, conn) -> None:
+        self._size -= 1
+        self._discarded += 1
+        await run_blocking(_close_quietly, conn)
+
+    async def _evict_idle(self) -> None:
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            await self._discard(conn)
+
+    async def close(self) -> None:
+        while self._idle:
+            conn, _ = self._idle.popleft()
+            await self._discard(conn)
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "in_use": self._size - len(self._idle),
+            "idle": len(self._idle),
+            "waiting": self._waiting,
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "acquisitions": self._acquisitions,
+            "timeouts": self._timeouts,
+            "created": self._created,
+            "discarded": self._discarded,
+            "avg_wait_ms": round(self._total_wait / self._acquisitions * 1000, 3) if self._acquisitions else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 3),
+        }
+
+# Un pool por destino (primary, replica)
+_pools: dict[str, ConnectionPool] = {}
+_replica_breaker = CircuitBreaker("SQL replica", SQL_REPLICA_BREAKER_THRESHOLD, SQL_REPLICA_BREAKER_COOLDOWN,
+                                  SQL_REPLICA_BREAKER_MAX_COOLDOWN)
+# Ultima escritura de este worker por tabla: table -> time.monotonic()
+_last_write: dict[str, float] = {}
+
+async def get_db_pool(target: str = PRIMARY) -> ConnectionPool:
+    pool = _pools.get(target)
+    if pool is None:
+        if target == REPLICA:
+            pool = ConnectionPool(lambda: get_db_connection(read_only=True), max_size=SQL_REPLICA_POOL_MAX_SIZE)
+        else:
+            pool = ConnectionPool(get_db_connection)
+        _pools[target] = pool
+        await pool.open()
+    return pool
+
+async def open_db_pools() -> None:
+    """Opens the primary pool and, when enabled, the replica pool (a replica failure only trips its circuit)"""
+    await get_db_pool(PRIMARY)
+    if SQL_READ_REPLICA:
+        try:
+            await get_db_pool(REPLICA)
+        except DatabaseConnectionError as e:
+            _replica_breaker.record_failure()
+            logger.warning(f"Replica de lectura no disponible, se lee del primario: {e}")
+
+async def close_db_pool() -> None:
+    while _pools:
+        _, pool = _pools.popitem()
+        await pool.close()
+    logger.info("Pool de conexiones cerrado.")
+
+def get_pool_stats() -> dict:
+    stats = {target: pool.stats() for target, pool in _pools.items()}
+    if SQL_READ_REPLICA:
+        stats["replica_circuit"] = _replica_breaker.stats()
+    return stats
+
+async def _after_write(sql_template: str, tables=None) -> None:
+    """Fences the written tables to the primary and invalidates the query results tagged with them"""
+    tables = query_tables(sql_template) if tables is None else set(tables)
+    now = time.monotonic()
+    for table in tables:
+        _last_write[table] = now
+    await invalidate_tables(tables)
+
+def _read_target(sql_template: str, primary: bool) -> str:
+    """Replica unless disabled, forced, unhealthy, or the query reads a table this worker just wrote"""
+    if primary or not SQL_READ_REPLICA:
+        return PRIMARY
+    now = time.monotonic()
+    if any(now - _last_write.get(table, float('-inf')) < SQL_REPLICA_WRITE_FENCE for table in query_tables(sql_template)):
+        return PRIMARY
+    return REPLICA if _replica_breaker.allow() else PRIMARY
+
+def _is_connection_error(e: BaseException) -> bool:
+    if isinstance(e, DatabaseConnectionError):
+        return True
+    # SQLSTATE 08xxx: conexion perdida o rechazada; HYT00/HYT01: timeout
+    return isinstance(e, pyodbc.Error) and bool(e.args) and str(e.args[0]).startswith(("08", "HYT0"))
+
+def _replica_unavailable(e: BaseException) -> bool:
+    # Un pool de replica saturado tambien desvia la lectura al primario
+    return isinstance(e, PoolTimeoutError) or _is_connection_error(e)
+
+async def _run_read(sql_template: str, primary: bool, func, *args):
+    """Runs a read on the replica when possible, falling back to the primary if the replica cannot be reached"""
+    if _read_target(sql_template, primary) == REPLICA:
+        try:
+            pool = await get_db_pool(REPLICA)
+            result = await pool.run(func, *args)
+        except Exception as e:
+            if not _replica_unavailable(e):
+                # La replica respondio: el error es de la consulta
+                _replica_breaker.record_success()
+                raise
+            _replica_breaker.record_failure()
+            logger.warning(f"Replica de lectura no disponible, se lee del primario: {e}")
+        else:
+            _replica_breaker.record_success()
+            record_db_target(REPLICA)
+            return result
+
+    pool = await get_db_pool(PRIMARY)
+    result = await pool.run(func, *args)
+    record_db_target(PRIMARY)
+    return result
+
+class QueryResult:
+    """
+    Result set returned by ``execute_query_rows``.
+
+    ``rows`` holds one tuple per row and ``index`` maps each column name to its
+    position, so callers can read values without building a dict per row.
+    """
+    __slots__ = ("columns", "index", "rows")
+
+    def __init__(self, columns: list[str], rows: list[tuple]):
+        self.columns = columns
+        self.index = {name: position for position, name in enumerate(columns)}
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def column(self, name: str) -> list:
+        position = self.index[name]
+        return [row[position] for row in self.rows]
+
+    def as_dicts(self) -> list[dict]:
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+def _row_converter(cursor, converters=None):
+    """
+    Builds the per-row conversion for a result set, or None when rows can be
+    used as they come. Binary columns are always returned as str.
+    """
+    funcs = []
+    for column in cursor.description:
+        func = (converters or {}).get(column[0])
+        if func is None and column[1] in (bytes, bytearray):
+            func = str
+        funcs.append(func)
+
+    if not any(funcs):
+        return None
+    return lambda row: tuple(value if func is None or value is None else func(value) for func, value in zip(funcs, row))
+
+def _execute_rows(conn, sql_template, params, needs_commit, converters=None):
+    cursor = conn.cursor()
+    try:
         #param_info = "(sin parámetros)" if not params else f"(con {len(params)} parámetros)"
         #logger.info(f"Ejecutando consulta {param_info}: {sql_template}")
 
-        if params:
-            cursor.execute(sql_template, params)
-        else:
-            cursor.execute(sql_template)
+        with span("db.execute"):
+            if params:
+                cursor.execute(sql_template, params)
+            else:
+                cursor.execute(sql_template)
 
-        results = []
+        result = QueryResult([], [])
         if cursor.description:
             columns = [column[0] for column in cursor.description]
             logger.info(f"Columnas obtenidas: {columns}")
-            for row in cursor.fetchall():
-                processed_row = [str(item) if isinstance(item, (bytes, bytearray)) else item for item in row]
-                results.append(dict(zip(columns, processed_row)))
+            convert = _row_converter(cursor, converters)
+            with span("db.fetch"):
+                rows = cursor.fetchall()
+                result = QueryResult(columns, [convert(row) for row in rows] if convert else [tuple(row) for row in rows])
         else:
              logger.info("La consulta no devolvió columnas (posiblemente INSERT/UPDATE/DELETE).")
 
         if needs_commit:
             logger.info("Realizando commit de la transacción.")
-            conn.commit()
+            with span("db.commit"):
+                conn.commit()
+        else:
+            # Cierra la transaccion implicita antes de devolver la conexion al pool
+            conn.rollback()
 
-        return json.dumps(results, default=str)
+        return result
+
+    except pyodbc.Error:
+        # Tambien en lecturas: la conexion vuelve al pool sin la transaccion implicita abierta
+        try:
+            logger.warning("Realizando rollback debido a error.")
+            conn.rollback()
+        except pyodbc.Error as rb_e:
+             logger.error(f"Error durante el rollback: {rb_e}")
+        raise
+    finally:
+        cursor.close()
+
+async def execute_query_rows(sql_template, params=None, needs_commit=False, converters=None, primary=False,
+                             tables=None) -> QueryResult:
+    """
+    Executes a query and returns its rows as tuples, without the JSON round trip.
+
+    ``converters`` optionally maps column names to callables applied to every
+    non-null value of that column (for example ``{"price": Decimal}``).
+
+    Writes (``needs_commit=True``) run on the primary; reads go to the read
+    replica when it is enabled, unless ``primary=True`` is passed for a read
+    that must see a write made elsewhere.
+
+    A committed write invalidates the cached results of the tables it touches,
+    parsed from the SQL or given as ``tables`` (``amazon.<table>`` names) when
+    the statement does not name them, e.g. a stored procedure.
+    """
+    try:
+        if needs_commit:
+            pool = await get_db_pool(PRIMARY)
+            result = await pool.run(_execute_rows, sql_template, params, needs_commit, converters)
+            record_db_target(PRIMARY)
+            await _after_write(sql_template, tables)
+            return result
+        return await _run_read(sql_template, primary, _execute_rows, sql_template, params, needs_commit, converters)
 
     except pyodbc.Error as e:
         logger.error(f"Error ejecutando la consulta (SQLSTATE: {e.args[0]}): {str(e)}")
-        if conn and needs_commit:
-            try:
-                logger.warning("Realizando rollback debido a error.")
-                conn.rollback()
-            except pyodbc.Error as rb_e:
-                 logger.error(f"Error durante el rollback: {rb_e}")
-
         raise Exception(f"Error ejecutando consulta: {str(e)}") from e
     except Exception as e:
         logger.error(f"Error inesperado durante la ejecución de la consulta: {str(e)}")
-        logger.error("ERROR", e)
         raise # Relanza el error inesperado
+
+async def _query_json(sql_template, params, needs_commit, primary, tables) -> str:
+    result = await execute_query_rows(sql_template, params, needs_commit, primary=primary, tables=tables)
+    with span("json.dumps"):
+        return json.dumps(result.as_dicts(), default=str)
+
+async def execute_query_json(sql_template, params=None, needs_commit=False, primary=False, cache_ttl=None, tables=None):
+    """
+    Executes a query and returns its rows as a JSON array string.
+
+    With ``cache_ttl`` (seconds) a read is served from the query cache, keyed by
+    the normalized SQL and params and tagged with the tables it reads (or
+    ``tables``); every write to those tables made through this module
+    invalidates it.
+    """
+    if cache_ttl and not needs_commit:
+        # Las recargas leen del primario: un resultado reconstruido tras una escritura
+        # no puede venir de una replica atrasada y quedarse en cache todo el TTL
+        return await get_or_query(sql_template, params,
+                                  lambda: _query_json(sql_template, params, False, True, tables), cache_ttl, tables)
+    return await _query_json(sql_template, params, needs_commit, primary, tables)
+
+def _execute_many(conn, sql_template, rows):
+    """
+    Runs one chunk with fast_executemany in a single transaction. If the chunk
+    fails it is rolled back and retried row by row to isolate the failing rows.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.fast_executemany = True
+        try:
+            with span("db.execute_many"):
+                cursor.executemany(sql_template, rows)
+                conn.commit()
+            return []
+        except pyodbc.Error as e:
+            logger.warning(f"Lote de {len(rows)} filas rechazado, reintentando fila por fila: {str(e)}")
+            conn.rollback()
+
+        errors = []
+        for position, row in enumerate(rows):
+            try:
+                cursor.execute(sql_template, row)
+                conn.commit()
+            except pyodbc.Error as e:
+                conn.rollback()
+                errors.append((position, str(e)))
+        return errors
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-            logger.info("Conexión cerrada.")
\ No newline at end of file
+        cursor.close()
+
+async def execute_many(sql_template, rows, chunk_size=SQL_BULK_CHUNK_SIZE, tables=None) -> list[tuple[int, str]]:
+    """
+    Executes ``sql_template`` once per row in chunked transactions.
+
+    Returns ``(row_position, error)`` for every row that could not be written;
+    the remaining rows are committed. A chunk that fails as a whole (driver
+    error, lost connection, pool timeout) reports all its rows and the load
+    continues with the next chunk.
+    """
+    errors = []
+    written = False
+    try:
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            try:
+                pool = await get_db_pool(PRIMARY)
+                chunk_errors = await pool.run(_execute_many, sql_template, chunk)
+            except pyodbc.Error as e:
+                logger.error(f"Error ejecutando lote (SQLSTATE: {e.args[0]}): {str(e)}")
+                chunk_errors = [(position, str(e)) for position in range(len(chunk))]
+            except Exception as e:
+                logger.error(f"Lote de {len(chunk)} filas no ejecutado: {str(e)}")
+                chunk_errors = [(position, str(e)) for position in range(len(chunk))]
+            if len(chunk_errors) < len(chunk):
+                written = True
+            errors.extend((start + position, error) for position, error in chunk_errors)
+    finally:
+        #Se invalida aunque un lote posterior falle o la peticion se cancele
+        if written:
+            await _after_write(sql_template, tables)
+    return errors
+
+def _open_cursor(conn, sql_template, params):
+    cursor = conn.cursor()
+    if params:
+        cursor.execute(sql_template, params)
+    else:
+        cursor.execute(sql_template)
+    return cursor
+
+def _finish_cursor(conn, cursor) -> None:
+    if cursor:
+        cursor.close()
+    conn.rollback()
+
+async def _close_stream(pool, conn, cursor, pending, discard):
+    # Si un fetch sigue corriendo en su hilo se espera antes de soltar la conexion
+    if pending is not None:
+        await asyncio.gather(pending, return_exceptions=True)
+    try:
+        await run_blocking(_finish_cursor, conn, cursor)
+    except pyodbc.Error:
+        discard = True
+    await pool.release(conn, discard=discard)
+
+async def _acquire_for_read(sql_template: str, primary: bool):
+    if _read_target(sql_template, primary) == REPLICA:
+        try:
+            pool = await get_db_pool(REPLICA)
+            conn = await pool.acquire()
+            record_db_target(REPLICA)
+            return pool, conn, REPLICA
+        except (DatabaseConnectionError, PoolTimeoutError) as e:
+            _replica_breaker.record_failure()
+            logger.warning(f"Replica de lectura no disponible, se lee del primario: {e}")
+    pool = await get_db_pool(PRIMARY)
+    conn = await pool.acquire()
+    record_db_target(PRIMARY)
+    return pool, conn, PRIMARY
+
+async def stream_query(sql_template, params=None, batch_size=SQL_STREAM_BATCH_SIZE, primary=False):
+    """
+    Async generator yielding the result set in batches of ``batch_size`` dicts.
+
+    Rows are read with ``cursor.fetchmany`` so memory stays bounded by the batch
+    size; the pooled connection is held until the generator finishes or closes.
+    Like every read it runs on the replica when one is enabled.
+    """
+    pool, conn, target = await _acquire_for_read(sql_template, primary)
+    cursor = None
+    pending = None
+    answered = target != REPLICA
+    try:
+        cursor = await run_blocking(_open_cursor, conn, sql_template, params)
+        columns = [column[0] for column in cursor.description] if cursor.description else []
+        convert = _row_converter(cursor) if cursor.description else None
+        while True:
+            pending = asyncio.ensure_future(run_blocking(cursor.fetchmany, batch_size))
+            with span("db.fetch"):
+                rows = await asyncio.shield(pending)
+            pending = None
+            if not answered:
+                # La replica entrego el primer lote
+                _replica_breaker.record_success()
+                answered = True
+            if not rows:
+                break
+            yield [dict(zip(columns, convert(row) if convert else row)) for row in rows]
+    except BaseException as e:
+        if not answered and _is_connection_error(e):
+            _replica_breaker.record_failure()
+        # _close_stream hace rollback; solo se descarta una conexion caida
+        asyncio.ensure_future(_close_stream(pool, conn, cursor, pending, _is_connection_error(e)))
+        if isinstance(e, pyodbc.Error):
+            logger.error(f"Error leyendo la consulta en streaming: {str(e)}")
+            raise Exception(f"Error ejecutando consulta: {str(e)}") from e
+        raise
+
+    await _close_stream(pool, conn, cursor, None, False)
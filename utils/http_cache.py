@@ -0,0 +1,45 @@
+import os
+import hashlib
+from typing import Optional
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+
+CATALOG_HTTP_MAX_AGE = int(os.getenv("CATALOG_HTTP_MAX_AGE", "60"))
+CATALOG_HTTP_STALE_WHILE_REVALIDATE = int(os.getenv("CATALOG_HTTP_STALE_WHILE_REVALIDATE", "300"))
+
+def make_etag(*parts) -> str:
+    """Weak validator: the same value under any content encoding"""
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Comparacion debil (RFC 9110): se ignora el prefijo W/
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+def _not_modified_since(if_modified_since: str, last_modified: float) -> bool:
+    try:
+        return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def cache_headers(etag: str, last_modified: Optional[float] = None, max_age: int = CATALOG_HTTP_MAX_AGE) -> dict:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={CATALOG_HTTP_STALE_WHILE_REVALIDATE}",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """True when the client's copy is still current; If-None-Match takes precedence over If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    return bool(if_modified_since) and last_modified is not None and _not_modified_since(if_modified_since, last_modified)
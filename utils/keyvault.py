@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
 import os
+import time
+import asyncio
 import logging
 
 from fastapi import HTTPException
@@ -8,36 +10,114 @@ from azure.core.exceptions import AzureError
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
 
+from utils.metrics import span, record_cache
+
 load_dotenv()
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Tiempo de vida de un secret en cache y ventana de refresco anticipado (segundos)
+SECRET_CACHE_TTL = float(os.getenv('KEY_VAULT_SECRET_TTL', '900'))
+SECRET_REFRESH_AHEAD = float(os.getenv('KEY_VAULT_REFRESH_AHEAD', '120'))
+
+# Secrets que usa la API, descargados juntos al arrancar (ver prefetch_secrets)
+KEY_VAULT_PREFETCH = [name.strip() for name in os.getenv(
+    'KEY_VAULT_PREFETCH',
+    'sql-driver,sql-server,sql-database,sql-username,sql-password,redis-connection-string,'
+    'jwt-secret-key,firebase-secret,firebase-api-key,applicationinsights-connection-string'
+).split(',') if name.strip()]
+
+# Cliente unico para todo el proceso y cache de secrets: name -> (value, fetched_at)
+_client = None
+_secret_cache: dict[str, tuple[str, float]] = {}
+_inflight: dict[str, asyncio.Future] = {}
+
 async def get_client_keyvault():
+    global _client
+    if _client is not None:
+        return _client
+
     try:
         key_vault_url = os.getenv('KEY_VAULT_URL')
 
-        logger.info(f"Intentando conectar al key vault...")        
+        logger.info(f"Intentando conectar al key vault...")
         # Automatically uses Managed Identity (Azure) or Azure CLI/MSAL (local)
         credential = DefaultAzureCredential()
-        client = SecretClient(vault_url=key_vault_url, credential=credential)
-        
+        _client = SecretClient(vault_url=key_vault_url, credential=credential)
+
         logger.info(f"Conexión exitosa al Key Vault.")
-        return client
+        return _client
     except AzureError as e:
         logger.error(f"Failed to connect key vault: {e}")
         raise HTTPException(status_code=500, detail=f"Key Vault connection failed: {str(e)}")
 
+def set_client_keyvault(client) -> None:
+    """
+    Replaces the process-wide Key Vault client and clears the secret cache.
+
+    Any object exposing ``get_secret(name)`` that returns something with a
+    ``value`` attribute works, which allows running against a local fake vault.
+    """
+    global _client
+    _client = client
+    clear_secret_cache()
+
+def clear_secret_cache() -> None:
+    _secret_cache.clear()
+
+async def _fetch_secret(secret_name):
+    client = await get_client_keyvault()
+    # El SDK es sincrono, se ejecuta fuera del event loop
+    with span("keyvault.get_secret"):
+        secret = await asyncio.to_thread(client.get_secret, secret_name)
+    _secret_cache[secret_name] = (secret.value, time.monotonic())
+    logger.info(f"Secret '{secret_name}' retrieved successfully")
+    return secret.value
+
+def _start_fetch(secret_name) -> asyncio.Future:
+    """Single-flight: concurrent misses for the same secret share one fetch."""
+    future = _inflight.get(secret_name)
+    if future is None:
+        future = asyncio.ensure_future(_fetch_secret(secret_name))
+        _inflight[secret_name] = future
+        future.add_done_callback(lambda f: _on_fetch_done(secret_name, f))
+    return future
+
+def _on_fetch_done(secret_name, future: asyncio.Future) -> None:
+    _inflight.pop(secret_name, None)
+    if not future.cancelled() and future.exception() is not None:
+        # Evita "exception was never retrieved" en refrescos de fondo
+        logger.warning(f"Failed to refresh secret '{secret_name}': {future.exception()}")
+
 async def get_secret_by_name(secret_name):
     if not secret_name:
         raise HTTPException(status_code=400, detail="Secret name not found")
-    
+
+    cached = _secret_cache.get(secret_name)
+    if cached:
+        value, fetched_at = cached
+        age = time.monotonic() - fetched_at
+        if age < SECRET_CACHE_TTL:
+            # Refresh-ahead: se renueva en segundo plano antes de expirar
+            if age >= SECRET_CACHE_TTL - SECRET_REFRESH_AHEAD:
+                _start_fetch(secret_name)
+            record_cache("keyvault", "hit")
+            return value
+
+    record_cache("keyvault", "miss")
     try:
-        client = await get_client_keyvault()
-        secret = client.get_secret(secret_name)
-        logger.info(f"Secret '{secret_name}' retrieved successfully")
-        return secret.value
+        return await asyncio.shield(_start_fetch(secret_name))
     except AzureError as e:
         logger.error(f"Failed to retrieve secret '{secret_name}': {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve secret: {str(e)}")
+
+async def prefetch_secrets(names=None) -> int:
+    """Loads ``names`` (default KEY_VAULT_PREFETCH) into the secret cache concurrently"""
+    names = KEY_VAULT_PREFETCH if names is None else names
+    results = await asyncio.gather(*(get_secret_by_name(name) for name in names), return_exceptions=True)
+    failed = [name for name, result in zip(names, results) if isinstance(result, BaseException)]
+    if failed:
+        raise Exception(f"Secrets not prefetched: {', '.join(failed)}")
+    return len(names)
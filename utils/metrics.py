@@ -0,0 +1,204 @@
+import os
+import time
+import math
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "amazonapi")
+
+# Limites (segundos) de los histogramas: de 0.5 ms a 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter per label set; safe to increment from the SQL executor threads"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items)
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, rendered in the Prometheus text format"""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}  # labels -> [counts por bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, inf)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+stage_seconds = Histogram(
+    f"{METRICS_PREFIX}_stage_duration_seconds",
+    "Time spent in each hot-path stage (Key Vault, ODBC, Redis, JSON, Pydantic...)",
+    ("stage",),
+)
+stage_errors = Counter(
+    f"{METRICS_PREFIX}_stage_errors_total",
+    "Stages that ended with an exception",
+    ("stage",),
+)
+cache_requests = Counter(
+    f"{METRICS_PREFIX}_cache_requests_total",
+    "Cache lookups by layer (local, redis, keyvault) and result (hit, stale, miss)",
+    ("layer", "result"),
+)
+db_queries = Counter(
+    f"{METRICS_PREFIX}_db_queries_total",
+    "Queries by database target (primary, replica)",
+    ("target",),
+)
+http_seconds = Histogram(
+    f"{METRICS_PREFIX}_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status",
+    ("method", "route", "status"),
+)
+
+# Valores puntuales (pool de conexiones, cache local, codec) leidos al renderizar
+_gauges: list[tuple[str, str, Callable[[], dict]]] = []
+
+def register_gauges(name: str, documentation: str, collect: Callable[[], dict]) -> None:
+    """
+    Exposes every numeric value of ``collect()`` as ``<prefix>_<name>{field="..."}``.
+    ``collect`` runs on each scrape, so it must be cheap and never raise.
+    """
+    _gauges.append((f"{METRICS_PREFIX}_{name}", documentation, collect))
+
+def observe(stage: str, seconds: float) -> None:
+    if METRICS_ENABLED:
+        stage_seconds.observe((stage,), seconds)
+
+def record_cache(layer: str, result: str) -> None:
+    if METRICS_ENABLED:
+        cache_requests.inc(layer, result)
+
+def record_db_target(target: str) -> None:
+    if METRICS_ENABLED:
+        db_queries.inc(target)
+
+@contextmanager
+def span(stage: str):
+    """Times the enclosed block as ``stage``; exceptions are counted and re-raised"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if METRICS_ENABLED:
+            stage_errors.inc(stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+def _render_gauges() -> list[str]:
+    lines = []
+    for name, documentation, collect in _gauges:
+        try:
+            values = collect() or {}
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for field, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"{name}{_labels(('field',), (field,))} {_number(value)}")
+    return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in (http_seconds, stage_seconds, stage_errors, cache_requests, db_queries):
+        lines.extend(metric.render())
+    lines.extend(_render_gauges())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    """
+    Records the latency of every HTTP request under its route template
+    (``/products/``, not the concrete URL) so label cardinality stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_seconds.observe((scope["method"], template, str(status)), time.perf_counter() - started)
@@ -0,0 +1,56 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from utils.redis_cache import get_redis_client, get_or_build, invalidate_cache_groups
+
+logger = logging.getLogger(__name__)
+
+# Cache de resultados de consultas: execute_query_json(..., cache_ttl=segundos)
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+QUERY_CACHE_KEY = "query"
+
+# Tablas del esquema amazon: amazon.products, [amazon].[products]...
+_TABLE_PATTERN = re.compile(r"\[?amazon\]?\.\[?(\w+)\]?", re.IGNORECASE)
+
+def query_tables(sql_template: str) -> set[str]:
+    """Tables of the amazon schema referenced by a statement, as ``amazon.<table>``"""
+    return {f"amazon.{name.lower()}" for name in _TABLE_PATTERN.findall(sql_template)}
+
+def table_tag(table: str) -> str:
+    """Cache group of every result read from ``table``"""
+    return f"{QUERY_CACHE_KEY}:table:{table}"
+
+def query_cache_key(sql_template: str, params=None) -> str:
+    #Mismo SQL con otros espacios o saltos de linea comparte llave
+    normalized = " ".join(sql_template.split())
+    payload = json.dumps([normalized, params], default=str, separators=(",", ":"))
+    return f"{QUERY_CACHE_KEY}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+async def get_or_query(sql_template: str, params, loader: Callable[[], Awaitable[Any]], expiration: int,
+                       tables: Optional[Iterable[str]] = None) -> Any:
+    """
+    Returns the cached result of a read, running ``loader`` on a miss.
+
+    The entry is tagged with every table the statement reads (``tables`` when
+    the SQL does not name them, e.g. a stored procedure), so any write to one of
+    them (see invalidate_tables) drops it. A result invalidated by a write is
+    never served stale: the next read waits for the new one.
+    """
+    if not QUERY_CACHE_ENABLED:
+        return await loader()
+
+    cache_key = query_cache_key(sql_template, params)
+    tables = query_tables(sql_template) if tables is None else set(tables)
+    groups = [table_tag(table) for table in sorted(tables)]
+    redis_client = await get_redis_client()
+    return await get_or_build(redis_client, cache_key, loader, expiration, groups=groups, serve_stale=False)
+
+async def invalidate_tables(tables: Iterable[str]) -> None:
+    """Marks as stale every cached entry tagged with any of ``tables``, in one operation"""
+    tags = [table_tag(table) for table in sorted(tables)]
+    if tags:
+        await invalidate_cache_groups(await get_redis_client(), tags)
@@ -1,82 +1,609 @@
 import os
 import json
+import time
+import uuid
+import random
+import asyncio
 import logging
-import redis
-from typing import Optional, Any
+import redis.asyncio as redis
+from typing import Optional, Any, Callable, Awaitable, NamedTuple, Iterable, Sequence
 from dotenv import load_dotenv
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError, WatchError
 from utils.keyvault import get_secret_by_name
+from utils.local_cache import LocalCache, LOCAL_CACHE_TTL
+from utils.circuit_breaker import CircuitBreaker
+from utils.cache_codec import CacheCodec
+from utils.metrics import span, record_cache
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", "2"))
+REDIS_BREAKER_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", "3"))
+REDIS_BREAKER_COOLDOWN = float(os.getenv("REDIS_BREAKER_COOLDOWN", "5"))
+REDIS_BREAKER_MAX_COOLDOWN = float(os.getenv("REDIS_BREAKER_MAX_COOLDOWN", "120"))
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Stale-while-revalidate: tiempo extra que se conserva un valor vencido, jitter de TTL
+# y espera maxima por la reconstruccion que hace otro worker
+CACHE_STALE_TTL = int(os.getenv("CACHE_STALE_TTL", "600"))
+CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", "0.1"))
+CACHE_LOCK_TTL = float(os.getenv("CACHE_LOCK_TTL", "30"))
+CACHE_LOCK_WAIT = float(os.getenv("CACHE_LOCK_WAIT", "5"))
+# Vida de los contadores de invalidacion en Redis; basta con que cubra una reconstruccion
+CACHE_GENERATION_TTL = int(os.getenv("CACHE_GENERATION_TTL", "3600"))
+
+class CacheEntry(NamedTuple):
+    """A value written by get_or_build with the content hash and build time of that version"""
+    data: Any
+    version: Optional[str]
+    built_at: Optional[float]
+
+_client: Optional[redis.Redis] = None
+_breaker = CircuitBreaker("Redis", REDIS_BREAKER_THRESHOLD, REDIS_BREAKER_COOLDOWN, REDIS_BREAKER_MAX_COOLDOWN)
+_init_lock = asyncio.Lock()
+
+# Cache L1 del worker, delante de Redis
+_local_cache = LocalCache()
+_listener_task: Optional[asyncio.Task] = None
+
+# Grupos de las llaves guardadas en la cache local de este worker: group_key -> llaves
+_local_groups: dict[str, set[str]] = {}
+
+# Reconstrucciones en curso en este worker: cache_key -> Future (y sus grupos)
+_building: dict[str, asyncio.Future] = {}
+_building_groups: dict[str, tuple[str, ...]] = {}
+
+# Invalidaciones vistas por este worker, por llave ("key:<llave>") y por grupo ("group:<grupo>").
+# Una reconstruccion que empezo antes de una invalidacion no deja su resultado como vigente
+_generations: dict[str, int] = {}
+
+# Formato binario de los valores guardados en Redis
+_codec = CacheCodec()
+
+# Identifica los avisos de invalidacion de este worker; el canal tambien se los devuelve
+_ORIGIN = uuid.uuid4().hex
+
 #REDIS_URL = os.getenv("REDIS_CONNECTION_STRING")
-#Para obtener el cliente, para establecer la conexión con Redis
-async def get_redis_client():
-    redis_url = await get_secret_by_name('redis-connection-string')
-    if not redis_url:
-        logger.error("Redis connection string no encontrado en Key Vault.")
+#Crea el cliente compartido (con pool de conexiones) para toda la vida de la app
+async def init_redis_client() -> Optional[redis.Redis]:
+    global _client
+    if _init_lock.locked():
+        # Otra tarea ya esta conectando; no se hace esperar a la peticion
+        return _client
+    async with _init_lock:
+        if _client is not None:
+            return _client
+
+        client = None
+        try:
+            redis_url = await get_secret_by_name('redis-connection-string')
+            if not redis_url:
+                logger.error("Redis connection string no encontrado en Key Vault.")
+                _breaker.record_failure()
+                return None
+
+            client = redis.from_url(
+                redis_url,
+                decode_responses=False,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                health_check_interval=30,
+                retry=Retry(ExponentialBackoff(cap=0.5, base=0.05), REDIS_RETRIES),
+                retry_on_error=[RedisConnectionError, RedisTimeoutError],
+            )
+
+            await client.ping()
+            _client = client
+            _breaker.record_success()
+            logger.info("Connected to Redis successfully using Connection String!")
+            return _client
+        except Exception as e:
+            # El error ahora será más específico si algo falla
+            logger.error(f"Error connecting to Redis with Connection String: {e}")
+            _breaker.record_failure()
+            if client is not None:
+                await client.aclose()
+            return None
+
+async def close_redis_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Redis client closed")
+
+#Para obtener el cliente compartido; None cuando Redis no esta disponible
+async def get_redis_client() -> Optional[redis.Redis]:
+    if not _breaker.allow():
         return None
+    if _client is None:
+        return await init_redis_client()
+    return _client
+
+def _record_error(e: Exception) -> None:
+    if isinstance(e, (RedisConnectionError, RedisTimeoutError, OSError)):
+        _breaker.record_failure()
+
+def _group_keys(group_key: Optional[str], groups: Sequence[str] = ()) -> tuple[str, ...]:
+    return ((group_key,) if group_key else ()) + tuple(groups)
+
+def _set_local(cache_key: str, entry: CacheEntry, size: int, groups: tuple[str, ...], ttl: Optional[float] = None) -> None:
+    _local_cache.set(cache_key, entry, size, ttl)
+    for group in groups:
+        members = _local_groups.setdefault(group, set())
+        members.add(cache_key)
+        if len(members) > 2 * _local_cache.max_entries:
+            # Se olvidan las llaves que la cache local ya desalojo
+            _local_groups[group] = {key for key in members if key in _local_cache}
 
+def _local_generation(cache_key: str, groups: tuple[str, ...]) -> tuple[int, ...]:
+    return (_generations.get(f"key:{cache_key}", 0),) + tuple(_generations.get(f"group:{group}", 0) for group in groups)
+
+def _bump_generation(name: str) -> None:
+    _generations[name] = _generations.get(name, 0) + 1
+
+def _forget_building(matches: Callable[[str], bool]) -> None:
+    # Las peticiones nuevas ya no se unen a una reconstruccion anterior a la invalidacion
+    for key in [key for key in _building if matches(key)]:
+        _building.pop(key, None)
+        _building_groups.pop(key, None)
+
+def _invalidate_local(message: dict) -> None:
+    if "prefix" in message:
+        prefix = message["prefix"]
+        _local_cache.delete_prefix(prefix)
+        _forget_building(lambda key: key.startswith(prefix))
+    elif "key" in message:
+        key = message["key"]
+        _local_cache.delete(key)
+        _bump_generation(f"key:{key}")
+        _forget_building(lambda building_key: building_key == key)
+    groups = set(message.get("groups", ()))
+    for group in groups:
+        _local_cache.delete_prefix(f"{group}:")
+        for key in _local_groups.pop(group, ()):
+            _local_cache.delete(key)
+        _bump_generation(f"group:{group}")
+    if groups:
+        _forget_building(lambda key: bool(groups.intersection(_building_groups.get(key, ()))))
+
+#Avisa al resto de workers para que eliminen la llave de su cache local
+async def _publish_invalidation(redis_client, message: dict) -> None:
+    _invalidate_local(message)
+    if not redis_client:
+        return
     try:
-        client = redis.from_url(
-            redis_url,
-            decode_responses=True
-        )
-
-        client.ping()
-        logger.info("Connected to Redis successfully using Connection String!")
-        return client
+        await redis_client.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({**message, "origin": _ORIGIN}))
     except Exception as e:
-        # El error ahora será más específico si algo falla
-        logger.error(f"Error connecting to Redis with Connection String: {e}")
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to publish cache invalidation {message}: {str(e)}")
+
+async def _listen_invalidations() -> None:
+    """Applies invalidations published by other workers to the local cache"""
+    backoff = 1.0
+    while True:
+        redis_client = await get_redis_client()
+        if not redis_client:
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+            # Mensajes perdidos mientras no habia suscripcion: se descarta todo lo local
+            _local_cache.clear()
+            backoff = 1.0
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message.get("type") == "message":
+                    data = json.loads(message["data"])
+                    # Las propias ya se aplicaron al publicar
+                    if data.get("origin") != _ORIGIN:
+                        _invalidate_local(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _record_error(e)
+            logger.warning(f"⚠️ Cache invalidation listener disconnected: {str(e)}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+def start_cache_invalidation_listener() -> None:
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(_listen_invalidations())
+
+async def stop_cache_invalidation_listener() -> None:
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+        _listener_task = None
+
+def get_local_cache_stats() -> dict:
+    return _local_cache.stats()
+
+def get_codec_stats() -> dict:
+    return _codec.stats.snapshot()
+
+def _queue_value(pipe, cache_key: str, blob: bytes, ttl: int) -> None:
+    """Queues an encoded value in a pipeline, split in chunk keys when it is too big"""
+    if len(blob) <= _codec.chunk_size:
+        pipe.setex(cache_key, ttl, blob)
+        return
+
+    # Cada escritura usa llaves de chunk nuevas: un lector nunca mezcla chunks de dos versiones.
+    # Las de la version anterior vencen solas con su TTL
+    version = uuid.uuid4().hex[:12]
+    chunks = _codec.split(blob)
+    for number, chunk in enumerate(chunks):
+        pipe.setex(_codec.chunk_key(cache_key, version, number), ttl, chunk)
+    pipe.setex(cache_key, ttl, _codec.manifest(version, len(chunks)))
+
+async def _load_value(redis_client, cache_key: str, blob: bytes) -> tuple[Optional[Any], int]:
+    """Decodes a value read from Redis, fetching its chunks with one MGET when it was split"""
+    manifest = _codec.read_manifest(blob)
+    if manifest is not None:
+        keys = [_codec.chunk_key(cache_key, manifest["version"], number) for number in range(manifest["chunks"])]
+        with span("redis.get"):
+            chunks = await redis_client.mget(keys)
+        if any(chunk is None for chunk in chunks):
+            return None, 0
+        blob = b"".join(chunks)
+    return _codec.decode(cache_key, blob), len(blob)
+
+def jittered_ttl(expiration: int) -> int:
+    """Spreads expirations so keys written together do not expire together"""
+    return max(1, int(expiration * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)))
+
+def _fresh_key(cache_key: str) -> str:
+    return f"fresh:{cache_key}"
+
+def _lock_key(cache_key: str) -> str:
+    return f"lock:{cache_key}"
+
+def _key_generation(cache_key: str) -> str:
+    return f"gen:{cache_key}"
+
+def _group_generation(group_key: str) -> str:
+    return f"{group_key}:gen"
+
+def _generation_keys(cache_key: str, groups: tuple[str, ...]) -> list[str]:
+    return [_key_generation(cache_key)] + [_group_generation(group) for group in groups]
+
+def _queue_generation_bumps(pipe, generation_keys: list[str]) -> None:
+    for generation_key in generation_keys:
+        pipe.incr(generation_key)
+        pipe.expire(generation_key, CACHE_GENERATION_TTL)
+
+async def _read_generations(redis_client, cache_key: str, groups: tuple[str, ...]) -> Optional[list]:
+    if not redis_client:
         return None
+    try:
+        return await redis_client.mget(_generation_keys(cache_key, groups))
+    except Exception as e:
+        _record_error(e)
+        return None
+
+def _unwrap_entry(value: Any) -> CacheEntry:
+    if isinstance(value, dict) and value.keys() == {"version", "built_at", "data"}:
+        return CacheEntry(value["data"], value["version"], value["built_at"])
+    # Valor escrito antes de guardar version y fecha
+    return CacheEntry(value, None, None)
 
-#Obtener cache mediante el cliente y key
-def get_from_cache(redis_client, cache_key: str) -> Optional[Any]:
+async def _write_entry(redis_client, cache_key: str, blob: bytes, ttl: int, groups: tuple[str, ...],
+                       fresh: bool, generations: Optional[list]) -> bool:
+    """
+    Writes the value and, if ``fresh``, its fresh marker. With ``generations``
+    the marker is only written when no invalidation of the key or its groups
+    ran since they were read (WATCH/MULTI). Returns whether it was written fresh.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if fresh and generations is not None:
+            generation_keys = _generation_keys(cache_key, groups)
+            await pipe.watch(*generation_keys)
+            fresh = await pipe.mget(generation_keys) == generations
+            pipe.multi()
+        # El valor vive mas que su marca de frescura para poder servirlo vencido
+        _queue_value(pipe, cache_key, blob, ttl + CACHE_STALE_TTL)
+        if fresh:
+            pipe.setex(_fresh_key(cache_key), ttl, 1)
+        for group in groups:
+            pipe.sadd(f"{group}:keys", cache_key)
+            pipe.expire(f"{group}:keys", ttl + CACHE_STALE_TTL)
+        await pipe.execute()
+    return fresh
+
+async def _store_entry(redis_client, cache_key: str, data: Any, expiration: int, groups: tuple[str, ...],
+                       local_generation: Optional[tuple] = None, generations: Optional[list] = None) -> CacheEntry:
+    """
+    Stores a rebuilt value. ``local_generation``/``generations`` are the
+    invalidation counters read before the loader ran: if the key or one of its
+    groups was invalidated meanwhile the value is kept only as stale.
+    """
+    ttl = jittered_ttl(expiration)
+    entry = CacheEntry(data, _codec.fingerprint(data), time.time())
+    blob = _codec.encode(cache_key, entry._asdict())
+
+    def current() -> bool:
+        return local_generation is None or local_generation == _local_generation(cache_key, groups)
+
+    fresh = current()
+    if redis_client:
+        try:
+            with span("redis.set"):
+                try:
+                    fresh = await _write_entry(redis_client, cache_key, blob, ttl, groups, fresh, generations)
+                except WatchError:
+                    # Invalidada entre la comprobacion y la escritura
+                    fresh = await _write_entry(redis_client, cache_key, blob, ttl, groups, False, None)
+            _breaker.record_success()
+            if fresh:
+                logger.info(f"✅ Cache key '{cache_key}' rebuilt, fresh for {ttl} seconds")
+        except Exception as e:
+            _record_error(e)
+            logger.warning(f"⚠️ Failed to cache key '{cache_key}': {str(e)}")
+
+    if fresh and current():
+        _set_local(cache_key, entry, len(blob), groups, min(LOCAL_CACHE_TTL, ttl))
+    else:
+        logger.info(f"♻️ Cache key '{cache_key}' was invalidated while rebuilding, stored as stale")
+    return entry
+
+async def _try_lock(redis_client, cache_key: str) -> Optional[str]:
     if not redis_client:
         return None
+    token = uuid.uuid4().hex
+    try:
+        if await redis_client.set(_lock_key(cache_key), token, nx=True, px=int(CACHE_LOCK_TTL * 1000)):
+            return token
+    except Exception as e:
+        _record_error(e)
+    return None
+
+async def _unlock(redis_client, cache_key: str, token: Optional[str]) -> None:
+    if not redis_client or not token:
+        return
+    try:
+        if await redis_client.get(_lock_key(cache_key)) == token.encode():
+            await redis_client.delete(_lock_key(cache_key))
+    except Exception as e:
+        _record_error(e)
 
+async def _rebuild(redis_client, cache_key, loader, expiration, groups, token):
     try:
-        cached_data = redis_client.get(cache_key)
+        #Contadores de invalidacion antes de leer los datos
+        local_generation = _local_generation(cache_key, groups)
+        generations = await _read_generations(redis_client, cache_key, groups)
+        with span("cache.build"):
+            data = await loader()
+        return await _store_entry(redis_client, cache_key, data, expiration, groups, local_generation, generations)
+    finally:
+        await _unlock(redis_client, cache_key, token)
+
+def _start_rebuild(redis_client, cache_key, loader, expiration, groups, token) -> asyncio.Future:
+    """Single-flight per worker: concurrent rebuilds of the same key share one task"""
+    future = _building.get(cache_key)
+    if future is None:
+        future = asyncio.ensure_future(_rebuild(redis_client, cache_key, loader, expiration, groups, token))
+        _building[cache_key] = future
+        _building_groups[cache_key] = groups
+        future.add_done_callback(lambda f: _on_rebuild_done(cache_key, f))
+    return future
+
+def _on_rebuild_done(cache_key: str, future: asyncio.Future) -> None:
+    # Tras una invalidacion la llave puede tener ya otra reconstruccion en curso
+    if _building.get(cache_key) is future:
+        _building.pop(cache_key, None)
+        _building_groups.pop(cache_key, None)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(f"⚠️ Failed to rebuild cache key '{cache_key}': {future.exception()}")
+
+async def _read_entry(redis_client, cache_key: str) -> tuple[Optional[CacheEntry], bool, int]:
+    """Returns (entry, is_fresh, size) for a key written by get_or_build"""
+    try:
+        with span("redis.get"):
+            cached_data, fresh = await redis_client.mget(cache_key, _fresh_key(cache_key))
+        _breaker.record_success()
         if cached_data:
-            logger.info("✅ Cache hit for key: %s", cache_key)
-            return json.loads(cached_data)
-    except json.JSONDecodeError as e:
+            data, size = await _load_value(redis_client, cache_key, cached_data)
+            if data is not None:
+                return _unwrap_entry(data), fresh is not None, size
+    except ValueError as e:
         logger.warning(f"⚠️ Corrupted cache data for key '{cache_key}', clearing: {str(e)}")
-        redis_client.delete(cache_key)
+        await redis_client.delete(cache_key)
     except Exception as e:
+        _record_error(e)
         logger.warning(f"⚠️ Cache retrieval failed for key '{cache_key}': {str(e)}")
+    return None, False, 0
 
-    return None
+async def get_or_build(redis_client, cache_key: str, loader: Callable[[], Awaitable[Any]],
+                       expiration: int, group_key: Optional[str] = None, groups: Sequence[str] = (),
+                       serve_stale: bool = True) -> Any:
+    """Returns the cached value of ``cache_key``; see get_or_build_entry"""
+    entry = await get_or_build_entry(redis_client, cache_key, loader, expiration, group_key, groups, serve_stale)
+    return entry.data
+
+async def get_or_build_entry(redis_client, cache_key: str, loader: Callable[[], Awaitable[Any]],
+                             expiration: int, group_key: Optional[str] = None, groups: Sequence[str] = (),
+                             serve_stale: bool = True) -> CacheEntry:
+    """
+    Returns the cached entry of ``cache_key``, building it with ``loader`` on a miss.
+
+    Concurrent misses are coalesced: one request per worker (and, through a Redis
+    lock, one worker at a time) runs the loader while the rest wait for its
+    result. Once the fresh TTL passes, or after ``invalidate_cache``, the previous
+    value keeps being served for up to ``CACHE_STALE_TTL`` seconds while a single
+    background task rebuilds it; with ``serve_stale=False`` a stale value is
+    treated as a miss.
+
+    The key is registered in ``group_key`` and in every one of ``groups``, so
+    invalidating any of them marks it as stale.
+    """
+    groups = _group_keys(group_key, groups)
+    local_entry = _local_cache.get(cache_key)
+    if local_entry is not None:
+        record_cache("local", "hit")
+        return local_entry
+    record_cache("local", "miss")
+
+    if redis_client:
+        entry, fresh, size = await _read_entry(redis_client, cache_key)
+        if entry is not None:
+            if fresh:
+                logger.info("✅ Cache hit for key: %s", cache_key)
+                record_cache("redis", "hit")
+                _set_local(cache_key, entry, size, groups)
+                return entry
+
+            record_cache("redis", "stale")
+            if serve_stale:
+                logger.info("♻️ Serving stale value for key: %s", cache_key)
+                if cache_key not in _building:
+                    token = await _try_lock(redis_client, cache_key)
+                    if token:
+                        _start_rebuild(redis_client, cache_key, loader, expiration, groups, token)
+                return entry
+        else:
+            record_cache("redis", "miss")
 
-#Para eliminar una llave que ya se encuentra dentro de la BD, mediante el cliente y key
-def delete_cache(redis_client, cache_key: str) -> bool:
+    if cache_key in _building:
+        return await asyncio.shield(_building[cache_key])
+
+    token = await _try_lock(redis_client, cache_key)
+    if redis_client and not token:
+        # Otro worker esta reconstruyendo la llave: se espera su resultado
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            entry, fresh, _ = await _read_entry(redis_client, cache_key)
+            if entry is not None and (fresh or serve_stale):
+                return entry
+            # Lock liberado sin dejar un valor vigente (p. ej. invalidado mientras se construia)
+            token = await _try_lock(redis_client, cache_key)
+            if token:
+                break
+        else:
+            logger.warning(f"⚠️ Timed out waiting for cache key '{cache_key}', building it locally")
+
+    if cache_key in _building:
+        await _unlock(redis_client, cache_key, token)
+        return await asyncio.shield(_building[cache_key])
+    return await asyncio.shield(_start_rebuild(redis_client, cache_key, loader, expiration, groups, token))
+
+def get_encoded(cache_key: str, entry: CacheEntry, encode: Callable[[Any], bytes]) -> bytes:
+    """Response body of an entry, encoded once per version and kept in the local cache"""
+    if entry.version is None:
+        with span("response.encode"):
+            return encode(entry.data)
+    # Ligado a la version: un valor reconstruido tiene otra version y nunca reutiliza un cuerpo anterior;
+    # los cuerpos viejos salen de la cache local por TTL o LRU
+    body_key = f"{cache_key}:body:{entry.version}"
+    body = _local_cache.get(body_key)
+    if body is None:
+        with span("response.encode"):
+            body = encode(entry.data)
+        _local_cache.set(body_key, body, len(body))
+    return body
+
+#Marca la llave como vencida: se sigue sirviendo mientras una sola peticion la reconstruye
+async def invalidate_cache(redis_client, cache_key: str) -> None:
+    await _publish_invalidation(redis_client, {"key": cache_key})
     if not redis_client:
-        logger.info("ℹ️ Redis not available - cache deletion skipped")
-        return False
+        return
+    try:
+        # Primero el contador: una reconstruccion en curso ya no puede dejar su valor como vigente
+        async with redis_client.pipeline(transaction=False) as pipe:
+            _queue_generation_bumps(pipe, [_key_generation(cache_key)])
+            pipe.delete(_fresh_key(cache_key))
+            await pipe.execute()
+        _breaker.record_success()
+        logger.info(f"🗑️ Cache key '{cache_key}' marked as stale")
+    except Exception as e:
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to invalidate cache key '{cache_key}': {str(e)}")
 
+#Marca como vencidas las llaves de varios grupos a la vez: un solo mensaje y un SUNION
+async def invalidate_cache_groups(redis_client, group_keys: Iterable[str]) -> None:
+    group_keys = list(dict.fromkeys(group_keys))
+    if not group_keys:
+        return
+    await _publish_invalidation(redis_client, {"groups": group_keys})
+    if not redis_client:
+        return
     try:
-        result = redis_client.delete(cache_key)
-        if result:
-            logger.info(f"🗑️ Cache key '{cache_key}' deleted successfully")
-            return True
-        else:
-            logger.info(f"ℹ️ Cache key '{cache_key}' did not exist")
-            return False
+        # Primero los contadores: una reconstruccion en curso ya no puede dejar su valor como vigente
+        async with redis_client.pipeline(transaction=False) as pipe:
+            _queue_generation_bumps(pipe, [_group_generation(group_key) for group_key in group_keys])
+            pipe.sunion([f"{group_key}:keys" for group_key in group_keys])
+            *_, members = await pipe.execute()
+        if members:
+            await redis_client.delete(*[_fresh_key(member.decode()) for member in members])
+        _breaker.record_success()
+        logger.info(f"🗑️ Cache groups {', '.join(group_keys)} marked as stale ({len(members)} keys)")
     except Exception as e:
-        logger.warning(f"⚠️ Failed to delete cache key '{cache_key}': {str(e)}")
-        return False
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to invalidate cache groups {', '.join(group_keys)}: {str(e)}")
 
-#Para crear una nueva llave/valor
-def store_in_cache(redis_client, cache_key: str, data: list[dict], expiration: int) -> None:
+# Contadores materializados en un hash de Redis. La marca COUNTERS_COMPLETE solo la
+# escribe replace_counters, asi un hash creado solo por HINCRBY no se toma como completo
+COUNTERS_COMPLETE = "_complete"
+
+async def get_counters(redis_client, hash_key: str) -> Optional[dict[str, int]]:
+    """Returns the counters of a hash written by replace_counters, None if missing or partial"""
+    if not redis_client:
+        return None
+    try:
+        values = await redis_client.hgetall(hash_key)
+        _breaker.record_success()
+    except Exception as e:
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to read counters '{hash_key}': {str(e)}")
+        return None
+    values = {field.decode(): int(value) for field, value in values.items()}
+    if values.pop(COUNTERS_COMPLETE, None) is None:
+        return None
+    return values
+
+async def replace_counters(redis_client, hash_key: str, counts: dict) -> None:
     if not redis_client:
-        logger.info("Redis not available - running without cache")
         return
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(hash_key)
+            pipe.hset(hash_key, mapping={**{str(field): value for field, value in counts.items()}, COUNTERS_COMPLETE: 1})
+            await pipe.execute()
+        _breaker.record_success()
+    except Exception as e:
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to store counters '{hash_key}': {str(e)}")
 
+async def increment_counters(redis_client, hash_key: str, increments: dict) -> None:
+    if not redis_client or not increments:
+        return
     try:
-        json_data = json.dumps(data, default=str)  # Handle datetime objects
-        redis_client.setex(cache_key, expiration, json_data)
-        logger.info(f"✅ Series catalog cached for {expiration} seconds")
+        async with redis_client.pipeline(transaction=True) as pipe:
+            for field, amount in increments.items():
+                pipe.hincrby(hash_key, str(field), amount)
+            await pipe.execute()
+        _breaker.record_success()
     except Exception as e:
-        logger.warning(f"⚠️ Failed to cache series catalog: {str(e)}")
\ No newline at end of file
+        _record_error(e)
+        logger.warning(f"⚠️ Failed to increment counters '{hash_key}': {str(e)}")
@@ -0,0 +1,32 @@
+import json
+from typing import Any, Iterable
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(data: Any) -> bytes:
+    """Compact JSON bytes; orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(data, default=str)
+    return json.dumps(data, default=str, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def project(rows: Iterable[dict], fields: tuple[str, ...]) -> list[dict]:
+    """Keeps only ``fields`` of every row, in that order (what the response model would emit)"""
+    return [{field: row.get(field) for field in fields} for row in rows]
+
+class JSONBytesResponse(Response):
+    """
+    JSON response for trusted data: bytes are sent as they are and anything else
+    is encoded with ``dumps``, without going through jsonable_encoder or the
+    endpoint's response model.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,169 @@
+import os
+import re
+import heapq
+import bisect
+import asyncio
+import logging
+import unicodedata
+from typing import Iterable, Optional
+
+from utils.database import stream_query
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_REFRESH = float(os.getenv("SEARCH_INDEX_REFRESH", "900"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Orden de las columnas de cada producto guardado en el indice
+PRODUCT_FIELDS = ("asin", "title", "imgUrl", "productURL", "stars", "price", "category_id")
+_STARS = PRODUCT_FIELDS.index("stars")
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """Lowercase alphanumeric tokens with accents removed"""
+    if not text:
+        return []
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    return TOKEN_RE.findall(normalized.encode("ascii", "ignore").decode("ascii"))
+
+class ProductSearchIndex:
+    """
+    Inverted index over product titles.
+
+    Every query token is matched as a prefix of the indexed tokens, all query
+    tokens must match, and results are ranked by stars (highest first).
+    """
+
+    def __init__(self):
+        self._postings: dict[str, set[str]] = {}
+        self._vocabulary: list[str] = []
+        self._products: dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def add(self, product: dict) -> None:
+        asin = product.get("asin")
+        if not asin:
+            return
+        if asin in self._products:
+            self.remove(asin)
+
+        self._products[asin] = tuple(product.get(field) for field in PRODUCT_FIELDS)
+        for token in set(tokenize(product.get("title"))):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                bisect.insort(self._vocabulary, token)
+            postings.add(asin)
+
+    def add_many(self, products: Iterable[dict]) -> None:
+        for product in products:
+            self.add(product)
+
+    def remove(self, asin: str) -> None:
+        product = self._products.pop(asin, None)
+        if product is None:
+            return
+        for token in set(tokenize(product[1])):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(asin)
+            if not postings:
+                del self._postings[token]
+                position = bisect.bisect_left(self._vocabulary, token)
+                if position < len(self._vocabulary) and self._vocabulary[position] == token:
+                    del self._vocabulary[position]
+
+    def _match_prefix(self, prefix: str) -> set[str]:
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_right(self._vocabulary, prefix + "\uffff", lo=start)
+        if end - start == 1:
+            return self._postings[self._vocabulary[start]]
+        matches = set()
+        for token in self._vocabulary[start:end]:
+            matches |= self._postings[token]
+        return matches
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> tuple[int, list[dict]]:
+        """Returns the total number of matches and one page of products"""
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        candidate_sets = sorted((self._match_prefix(token) for token in set(tokens)), key=len)
+        matches = set(candidate_sets[0])
+        for candidates in candidate_sets[1:]:
+            matches &= candidates
+            if not matches:
+                return 0, []
+
+        # Solo se ordena lo necesario para la pagina pedida
+        products = self._products
+        ranked = heapq.nsmallest(
+            offset + limit,
+            matches,
+            key=lambda asin: (-(products[asin][_STARS] or 0.0), asin)
+        )
+        return len(matches), [dict(zip(PRODUCT_FIELDS, products[asin])) for asin in ranked[offset:]]
+
+# Indice del proceso; None mientras se construye por primera vez
+_index: Optional[ProductSearchIndex] = None
+_building: Optional[list[dict]] = None
+_index_task: Optional[asyncio.Task] = None
+
+async def build_search_index() -> int:
+    """Builds a new index from amazon.products and swaps it in"""
+    global _index, _building
+    index = ProductSearchIndex()
+    _building = []
+    try:
+        async for batch in stream_query("SELECT asin, title, imgUrl, productURL, stars, price, category_id FROM amazon.products"):
+            index.add_many(batch)
+        #Productos creados mientras se leia la tabla
+        index.add_many(_building)
+    finally:
+        _building = None
+
+    _index = index
+    logger.info(f"Search index built ({len(index)} products)")
+    return len(index)
+
+async def _maintain_search_index() -> None:
+    while True:
+        try:
+            await build_search_index()
+        except Exception as e:
+            logger.warning(f"Failed to build search index: {e}")
+            if _index is None:
+                await asyncio.sleep(min(SEARCH_INDEX_REFRESH, 30))
+                continue
+        #Reconstruccion periodica: recoge altas hechas por otros workers
+        await asyncio.sleep(SEARCH_INDEX_REFRESH)
+
+def start_search_index() -> None:
+    global _index_task
+    if _index_task is None or _index_task.done():
+        _index_task = asyncio.create_task(_maintain_search_index())
+
+async def stop_search_index() -> None:
+    global _index_task
+    if _index_task is not None:
+        _index_task.cancel()
+        try:
+            await _index_task
+        except asyncio.CancelledError:
+            pass
+        _index_task = None
+
+def get_search_index() -> Optional[ProductSearchIndex]:
+    return _index
+
+def index_products(products: Iterable[dict]) -> None:
+    """Adds freshly inserted products to the live index"""
+    products = list(products)
+    if _index is not None:
+        _index.add_many(products)
+    if _building is not None:
+        _building.extend(products)
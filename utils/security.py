@@ -1,10 +1,14 @@
 import os
 import jwt
+import time
+import hashlib
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from fastapi import HTTPException
+from typing import Optional
+from fastapi import HTTPException, Request
 from dotenv import load_dotenv
-from jwt import PyJWTError
+from jwt import PyJWTError, InvalidSignatureError
 from functools import wraps
 
 from utils.keyvault import get_secret_by_name
@@ -12,10 +16,11 @@ from utils.keyvault import get_secret_by_name
 load_dotenv()
 
 #SECRET_KEY = os.getenv("SECRET_KEY")
+JWT_VERIFIED_CACHE_SIZE = int(os.getenv("JWT_VERIFIED_CACHE_SIZE", "1024"))
 
 # Función para crear un JWT
 async def create_jwt_token(firstName:str, lastName:str, email: str, active: bool, admin: bool):
-    secret_key = await get_secret_by_name("jwt-secret-key")
+    secret_key = (await get_signing_keys())[0]
     expiration = datetime.utcnow() + timedelta(hours=1)  # El token expira en 1 hora
     token = jwt.encode(
         {
@@ -32,97 +37,105 @@ async def create_jwt_token(firstName:str, lastName:str, email: str, active: bool
     )
     return token
 
-def validate(func):
-    @wraps(func)
-    async def wrapper( *args, **kwargs ):
-        request = kwargs.get('request')
-        if not request:
-            raise HTTPException(status_code=400, detail="Request object not found" )
+# Claves de firma en memoria: [actual, anterior]. La anterior se conserva tras una rotacion
+# para que los tokens ya emitidos sigan siendo validos hasta que expiren.
+_signing_keys: list[str] = []
 
-        authorization: str = request.headers.get("Authorization")
-        if not authorization:
-            raise HTTPException(status_code=400, detail="Authorization header missing" )
-
-        schema, token = authorization.split()
-        if schema.lower() != "bearer":
-            raise HTTPException(status_code=400, detail="Invalid auth schema" )
+# LRU de tokens ya verificados: sha256(token) -> claims. Cada entrada vale hasta su "exp".
+_verified_tokens: OrderedDict[str, dict] = OrderedDict()
 
+async def get_signing_keys() -> list[str]:
+    secret_key = await get_secret_by_name("jwt-secret-key")
+    if not _signing_keys or _signing_keys[0] != secret_key:
+        _signing_keys[:] = [secret_key] + _signing_keys[:1]
+        _verified_tokens.clear()
+    return _signing_keys
 
+def _decode_token(token: str, signing_keys: list[str]) -> dict:
+    for key in signing_keys[:-1]:
         try:
-            secret_key = await get_secret_by_name("jwt-secret-key")
-            payload = jwt.decode( token , secret_key , algorithms=["HS256"] )
-            email = payload.get("email")
-            firstName = payload.get("firstName")
-            lastName = payload.get("lastName")
-            active = payload.get("active")
-            exp = payload.get("exp")
+            return jwt.decode( token , key , algorithms=["HS256"] )
+        except InvalidSignatureError:
+            continue
+    return jwt.decode( token , signing_keys[-1] , algorithms=["HS256"] )
+
+def _get_verified_claims(digest: str) -> Optional[dict]:
+    claims = _verified_tokens.get(digest)
+    if claims is None:
+        return None
+    if claims["exp"] <= time.time():
+        _verified_tokens.pop(digest, None)
+        return None
+    _verified_tokens.move_to_end(digest)
+    return claims
+
+def _remember_claims(digest: str, claims: dict) -> None:
+    _verified_tokens[digest] = claims
+    while len(_verified_tokens) > JWT_VERIFIED_CACHE_SIZE:
+        _verified_tokens.popitem(last=False)
+
+async def authenticate(request: Request, admin: bool = False) -> dict:
+    """
+    Validates the Bearer token of the request and returns its claims.
+
+    Tokens that were already verified are served from an in-memory LRU until
+    their ``exp``; otherwise the token is decoded with the current signing key
+    (or the previous one after a rotation).
+    """
+    authorization: str = request.headers.get("Authorization")
+    if not authorization:
+        raise HTTPException(status_code=400, detail="Authorization header missing" )
+
+    parts = authorization.split()
+    if len(parts) != 2 or parts[0].lower() != "bearer":
+        raise HTTPException(status_code=400, detail="Invalid auth schema" )
+    token = parts[1]
+
+    signing_keys = await get_signing_keys()
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = _get_verified_claims(digest)
+    if claims is None:
+        try:
+            payload = _decode_token( token , signing_keys )
+        except PyJWTError:
+            raise HTTPException( status_code=401 , detail="Invalid token or expired token" )
 
-            if email is None or exp is None or active is None:
-                raise HTTPException(status_code=400, detail="Invalid token 3" )
+        if payload.get("email") is None or payload.get("exp") is None or payload.get("active") is None:
+            raise HTTPException(status_code=400, detail="Invalid token 3" )
 
-            if datetime.utcfromtimestamp(exp) < datetime.utcnow():
-                raise HTTPException( status_code=401, detail="Expired token" )
+        if payload["exp"] <= time.time():
+            raise HTTPException( status_code=401, detail="Expired token" )
 
-            if not active:
-                raise HTTPException( status_code=403, detail="Inactive user" )
+        if not payload["active"]:
+            raise HTTPException( status_code=403, detail="Inactive user" )
 
-            request.state.email = email
-            request.state.firstName = firstName
-            request.state.lastName = lastName
+        claims = payload
+        _remember_claims(digest, claims)
 
-        except PyJWTError:
-            raise HTTPException( status_code=401 , detail="Invalid token or expired token" )
+    if admin and not claims.get("admin"):
+        raise HTTPException( status_code=403, detail="Not Admin!" )
 
-        return await func( *args, **kwargs )
-    return wrapper
+    request.state.email = claims.get("email")
+    request.state.firstName = claims.get("firstName")
+    request.state.lastName = claims.get("lastName")
+    return claims
+
+def require_user(admin: bool = False):
+    """
+    FastAPI dependency factory: ``Depends(require_user())`` for any active user,
+    ``Depends(require_user(admin=True))`` for administrators.
+    """
+    async def dependency(request: Request) -> dict:
+        return await authenticate(request, admin=admin)
+    return dependency
 
-def validateadmin(func):
+def validate(func):
     @wraps(func)
     async def wrapper( *args, **kwargs ):
         request = kwargs.get('request')
         if not request:
             raise HTTPException(status_code=400, detail="Request object not found" )
 
-        authorization: str = request.headers.get("Authorization")
-        if not authorization:
-            raise HTTPException(status_code=400, detail="Authorization header missing" )
-
-        schema, token = authorization.split()
-        if schema.lower() != "bearer":
-            raise HTTPException(status_code=400, detail="Invalid auth schema" )
-
-
-        try:
-            secret_key = await get_secret_by_name("jwt-secret-key")
-            payload = jwt.decode( token , secret_key , algorithms=["HS256"] )
-            email = payload.get("email")
-            firstName = payload.get("firstName")
-            lastName = payload.get("lastName")
-            active = payload.get("active")
-            admin = payload.get("admin")
-            exp = payload.get("exp")
-
-            if email is None or exp is None or active is None:
-                raise HTTPException(status_code=400, detail="Invalid token 3" )
-
-            if datetime.utcfromtimestamp(exp) < datetime.utcnow():
-                raise HTTPException( status_code=401, detail="Expired token" )
-
-            if not active:
-                raise HTTPException( status_code=403, detail="Inactive user" )
-
-            if not admin:
-                raise HTTPException( status_code=403, detail="Not Admin!" )
-
-            request.state.email = email
-            request.state.firstName = firstName
-            request.state.lastName = lastName
-
-        except PyJWTError:
-            raise HTTPException( status_code=401 , detail="Invalid token or expired token" )
-
+        await authenticate(request)
         return await func( *args, **kwargs )
     return wrapper
-
-
-
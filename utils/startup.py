@@ -0,0 +1,89 @@
+import os
+import time
+import logging
+from typing import Any, Awaitable, Callable
+
+from utils.metrics import observe
+
+logger = logging.getLogger(__name__)
+
+def _flag(name: str, default: str = "true") -> bool:
+    return os.getenv(name, default).lower() not in ("0", "false", "no")
+
+# Calentamiento en el arranque: cada fase se puede desactivar por separado
+STARTUP_WARMUP = _flag("STARTUP_WARMUP")
+WARMUP_SECRETS = _flag("WARMUP_SECRETS")
+WARMUP_DATABASE = _flag("WARMUP_DATABASE")
+WARMUP_REDIS = _flag("WARMUP_REDIS")
+WARMUP_FIREBASE = _flag("WARMUP_FIREBASE")
+WARMUP_CATALOG = _flag("WARMUP_CATALOG")
+# Cuantas categorias (las de mas productos primero) se precargan; 0 = todas
+WARMUP_CATEGORY_LIMIT = int(os.getenv("WARMUP_CATEGORY_LIMIT", "0"))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))
+
+# fase -> {"status": ok|failed|skipped, "ms": duracion, "error": mensaje}
+_phases: dict[str, dict] = {}
+_started_at: float | None = None
+_finished_at: float | None = None
+# Componentes que se construyen en segundo plano y deben estar listos para recibir trafico
+_checks: dict[str, Callable[[], bool]] = {}
+
+def mark_startup_begin() -> None:
+    global _started_at, _finished_at
+    _phases.clear()
+    _started_at = time.perf_counter()
+    _finished_at = None
+
+def mark_startup_complete() -> None:
+    global _finished_at
+    _finished_at = time.perf_counter()
+    failed = [name for name, phase in _phases.items() if phase["status"] == "failed"]
+    logger.info(f"Startup completed in {(_finished_at - _started_at) * 1000:.0f} ms"
+                + (f" (failed phases: {', '.join(failed)})" if failed else ""))
+
+def reset_startup() -> None:
+    """Back to not-ready while shutting down, so /ready stops attracting traffic"""
+    global _started_at, _finished_at
+    _started_at = None
+    _finished_at = None
+
+async def run_phase(name: str, func: Callable[..., Awaitable[Any]], *args, enabled: bool = True) -> Any:
+    """
+    Runs one startup phase and records its duration. A failing phase is logged
+    and reported by /ready but does not abort the startup: the API falls back
+    to its lazy paths (connect on first use, build cache on first miss).
+    """
+    if not enabled:
+        _phases[name] = {"status": "skipped", "ms": 0.0}
+        return None
+
+    started = time.perf_counter()
+    # Si la fase se cancela (apagado, timeout) queda registrada como "running"
+    _phases[name] = {"status": "running"}
+    try:
+        result = await func(*args)
+        _phases[name] = {"status": "ok"}
+        return result
+    except Exception as e:
+        logger.warning(f"Startup phase '{name}' failed: {e}")
+        _phases[name] = {"status": "failed", "error": str(e)}
+        return None
+    finally:
+        elapsed = time.perf_counter() - started
+        _phases[name]["ms"] = round(elapsed * 1000, 3)
+        observe(f"startup.{name}", elapsed)
+        logger.info(f"Startup phase '{name}': {_phases[name]['status']} in {elapsed * 1000:.0f} ms")
+
+def register_readiness_check(name: str, check: Callable[[], bool]) -> None:
+    _checks[name] = check
+
+def get_readiness() -> dict:
+    checks = {name: bool(check()) for name, check in _checks.items()}
+    started = _finished_at is not None
+    return {
+        "ready": started and all(checks.values()),
+        "started": started,
+        "startup_ms": round((_finished_at - _started_at) * 1000, 3) if started else None,
+        "phases": dict(_phases),
+        "checks": checks,
+    }